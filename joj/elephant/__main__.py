@@ -0,0 +1,94 @@
+"""
+Validate or sync many problems in parallel.
+
+    python -m joj.elephant validate --source problems/ --output report.json
+    python -m joj.elephant sync --source problems/ --dest s3:bucket/problems \
+        --prefix a --rclone-config rclone.conf --jobs 16
+
+Problems are the directories under the source whose names start with
+--prefix, or the ones given by --problems. Exits with 1 if any problem
+failed.
+"""
+import argparse
+import logging
+import sys
+
+from loguru import logger
+
+from joj.elephant.bulk import (
+    BulkAction,
+    ProblemResult,
+    dump_report,
+    list_problems,
+    parse_rclone_config,
+    run_bulk,
+)
+
+
+def _print_progress(result: ProblemResult, done: int, total: int) -> None:
+    status = "ok" if result.ok else f"failed: {result.error}"
+    print(
+        f"[{done}/{total}] {result.problem} {status} ({result.seconds:.2f}s)",
+        file=sys.stderr,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m joj.elephant")
+    parser.add_argument("action", choices=[action.value for action in BulkAction])
+    parser.add_argument("--source", required=True, help="directory or remote:path")
+    parser.add_argument("--dest", help="directory or remote:path to sync to")
+    parser.add_argument("--problems", nargs="+", help="names of the problems")
+    parser.add_argument("--prefix", default="", help="prefix of the problem names")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: cpus)")
+    parser.add_argument("--rclone-config", help="rclone config file of the remotes")
+    parser.add_argument("--output", help="write the json report to this file")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    args = parser.parse_args()
+
+    action = BulkAction(args.action)
+    if action == BulkAction.sync and args.dest is None:
+        parser.error("sync needs --dest")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    logging.disable(logging.INFO)
+
+    rclone_config = ""
+    if args.rclone_config:
+        with open(args.rclone_config) as f:
+            rclone_config = f.read()
+    if args.problems:
+        problems = [
+            problem for problem in args.problems if problem.startswith(args.prefix)
+        ]
+    else:
+        problems = list_problems(
+            args.source, args.prefix, parse_rclone_config(rclone_config)
+        )
+
+    report = run_bulk(
+        action,
+        args.source,
+        problems,
+        dest=args.dest,
+        jobs=args.jobs,
+        rclone_config=rclone_config,
+        on_result=None if args.quiet else _print_progress,
+    )
+    data = dump_report(report)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data.decode("utf-8") + "\n")
+    print(
+        f"{report.succeeded} succeeded, {report.failed} failed "
+        f"in {report.seconds:.2f}s",
+        file=sys.stderr,
+    )
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
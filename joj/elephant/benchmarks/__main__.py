@@ -0,0 +1,73 @@
+"""
+Offline performance benchmarks.
+
+    python -m joj.elephant.benchmarks --output report.json
+    python -m joj.elephant.benchmarks --baseline report.json
+
+Exits with 1 if a result is slower than the baseline beyond its tolerance,
+or slower than its absolute budget (e.g. the import time of judge helpers).
+"""
+import argparse
+import logging
+import sys
+import tempfile
+
+from loguru import logger
+
+from joj.elephant.benchmarks.cases import DEFAULT_TOLERANCES
+from joj.elephant.benchmarks.runner import (
+    BENCHMARKS,
+    DEFAULT_TOLERANCE,
+    check_budgets,
+    compare_reports,
+    dump_report,
+    load_report,
+    run_benchmarks,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m joj.elephant.benchmarks")
+    parser.add_argument("--output", help="write the json report to this file")
+    parser.add_argument("--baseline", help="json report to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--scale", type=float, default=1.0, help="size of workloads")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS.keys()))
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # patool and the moto server log every archive and request, and patool
+    # resets its own level when it is imported
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory(prefix="elephant-benchmark-") as work_dir:
+        report = run_benchmarks(work_dir, args.scale, args.only)
+    data = dump_report(report)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(data)
+    else:
+        sys.stdout.write(data.decode("utf-8") + "\n")
+
+    for result in report.results:
+        if result.skipped is not None:
+            print(f"skipped {result.name}: {result.skipped}", file=sys.stderr)
+    regressions = check_budgets(report)
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = load_report(f.read())
+        regressions += compare_reports(
+            report, baseline, args.tolerance, DEFAULT_TOLERANCES
+        )
+    for regression in regressions:
+        print(
+            f"regression {regression.key}: {regression.baseline_seconds:.6f}s "
+            f"-> {regression.seconds:.6f}s",
+            file=sys.stderr,
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,318 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from joj.elephant.benchmarks.fake_rclone import PACKAGE_ROOT, install_fake_rclone
+from joj.elephant.benchmarks.runner import (
+    BenchmarkResult,
+    benchmark,
+    best_of,
+    peak_memory,
+    scaled,
+)
+from joj.elephant.listing import FileInfoBatch, diff_listings
+from joj.elephant.manager import Manager, fs_parse_gitignore_fd
+from joj.elephant.rclone import RClone
+from joj.elephant.schemas import Config, FileInfo
+from joj.elephant.storage import ArchiveStorage, LocalStorage, S3Storage, Storage
+
+KiB = 1024
+MiB = 1024 * KiB
+
+# benchmarks talking to a server in another thread are noisier
+DEFAULT_TOLERANCES: Dict[str, float] = {"s3_throughput": 0.5, "import_time": 0.5}
+
+# cold-start budget of short-lived judge helpers
+IMPORT_TIME_BUDGETS: Dict[str, float] = {
+    "joj.elephant.schemas": 0.25,
+    "joj.elephant.manager": 0.5,
+}
+
+
+def write_tree(root: str, num_files: int, file_size: int) -> None:
+    data = os.urandom(file_size)
+    for i in range(num_files):
+        dir_path = os.path.join(root, f"case{i // 100}")
+        os.makedirs(dir_path, exist_ok=True)
+        with open(os.path.join(dir_path, f"{i}.in"), "wb") as f:
+            f.write(data)
+
+
+def measure_throughput(
+    name: str, storage: Storage, sizes: List[int], repeat: int = 3
+) -> Iterator[BenchmarkResult]:
+    # sizes clamped by a small scale would report the same result key twice
+    for size in sorted(set(sizes)):
+        data = os.urandom(size)
+        path = Path(f"throughput/{size}.bin")
+        seconds = best_of(lambda: storage.upload(path, BytesIO(data)), repeat)
+        yield BenchmarkResult(
+            name=name,
+            params={"operation": "upload", "size": size},
+            seconds=seconds,
+            bytes=size,
+        )
+        seconds = best_of(lambda: storage.download(path, BytesIO()), repeat)
+        yield BenchmarkResult(
+            name=name,
+            params={"operation": "download", "size": size},
+            seconds=seconds,
+            bytes=size,
+        )
+
+
+@benchmark("local_throughput")
+def local_throughput(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    storage = LocalStorage(os.path.join(work_dir, "local"), create=True)
+    sizes = [4 * KiB, 1 * MiB, scaled(64 * MiB, scale, MiB)]
+    yield from measure_throughput("local_throughput", storage, sizes)
+    storage.close()
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def moto_s3_storage(bucket_name: str = "benchmark") -> Iterator[S3Storage]:
+    """Run an in-process moto server, yield an S3Storage on a new bucket."""
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    port = get_free_port()
+    endpoint_url = f"http://127.0.0.1:{port}"
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    try:
+        boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+        ).create_bucket(Bucket=bucket_name)
+        storage = S3Storage(
+            host_in_config="moto",
+            bucket_name=bucket_name,
+            username="benchmark",
+            password="benchmark",
+            endpoint_url=endpoint_url,
+        )
+        yield storage
+        storage.close()
+    finally:
+        server.stop()
+
+
+@benchmark("s3_throughput")
+def s3_throughput(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    with moto_s3_storage() as storage:
+        sizes = [4 * KiB, 1 * MiB, scaled(16 * MiB, scale, MiB)]
+        yield from measure_throughput("s3_throughput", storage, sizes)
+
+
+@benchmark("sync_small_files")
+def sync_small_files(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    num_files = scaled(2000, scale)
+    source_dir = os.path.join(work_dir, "sync_source")
+    write_tree(source_dir, num_files, 256)
+    with install_fake_rclone(os.path.join(work_dir, "bin")):
+        for run in ("full", "unchanged"):
+            dest_dir = os.path.join(work_dir, "sync_dest")
+            if run == "full":
+                shutil.rmtree(dest_dir, ignore_errors=True)
+            manager = Manager(
+                RClone(""),
+                LocalStorage(source_dir),
+                LocalStorage(dest_dir, create=True),
+            )
+            seconds = best_of(manager.sync_without_validation, repeat=1)
+            yield BenchmarkResult(
+                name="sync_small_files",
+                params={"files": num_files, "run": run},
+                seconds=seconds,
+                operations=num_files,
+                bytes=num_files * 256,
+            )
+
+
+@benchmark("archive")
+def archive(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    num_files = scaled(500, scale)
+    file_path = os.path.join(work_dir, "archive", "problem.zip")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    source = ArchiveStorage(file_path)
+    write_tree(source.path, num_files, 4 * KiB)
+
+    def compress() -> None:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        source.compress_all()
+
+    def extract() -> None:
+        dest = ArchiveStorage(file_path)
+        dest.extract_all()
+        dest.close()
+
+    params = {"files": num_files, "type": "zip"}
+    yield BenchmarkResult(
+        name="archive",
+        params={**params, "operation": "compress"},
+        seconds=best_of(compress),
+        operations=num_files,
+    )
+    yield BenchmarkResult(
+        name="archive",
+        params={**params, "operation": "extract"},
+        seconds=best_of(extract),
+        operations=num_files,
+    )
+    source.close()
+
+
+@benchmark("gitignore")
+def gitignore(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    rules = ["*.o", "*.exe", "build/", "/tmp", "**/cache/*", "!keep.o", "#comment"]
+    rules += [f"generated_{i}/*.out" for i in range(50)]
+    matches = fs_parse_gitignore_fd(StringIO("\n".join(rules)))
+    paths = [f"/case{i // 100}/{i}.{('in', 'o', 'out')[i % 3]}" for i in range(10000)]
+    num_paths = scaled(len(paths), scale)
+    paths = paths[:num_paths]
+    yield BenchmarkResult(
+        name="gitignore",
+        params={"rules": len(rules), "paths": num_paths},
+        seconds=best_of(lambda: [matches(path) for path in paths]),
+        operations=num_paths,
+    )
+
+
+def generate_config_dict(num_cases: int) -> Dict[str, Any]:
+    return {
+        "languages": [
+            {"name": "c++", "cases": [{"score": i % 10} for i in range(num_cases)]},
+            {"name": "python3", "compileFiles": [], "compileArgs": []},
+        ],
+        "languageDefault": {"caseDefault": {"time": "2s", "memory": "256m"}},
+    }
+
+
+@benchmark("config_validation")
+def config_validation(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    num_cases = scaled(10000, scale)
+    data = generate_config_dict(num_cases)
+    yield BenchmarkResult(
+        name="config_validation",
+        params={"cases": num_cases},
+        seconds=best_of(lambda: Config(**data)),
+        operations=num_cases,
+    )
+
+
+def model_listing(entries: List[Tuple[str, int, float]]) -> List[FileInfo]:
+    # what Storage.parse_file_info builds for every entry
+    return [
+        FileInfo(
+            path=path,
+            is_dir=False,
+            mtime=datetime.fromtimestamp(mtime, tz=timezone.utc),
+            size_bytes=size,
+        )
+        for path, size, mtime in entries
+    ]
+
+
+def compact_listing(entries: List[Tuple[str, int, float]]) -> FileInfoBatch:
+    batch = FileInfoBatch()
+    for path, size, mtime in entries:
+        batch.append(path, size_bytes=size, mtime_ns=int(mtime * 1e9))
+    return batch
+
+
+def diff_models(source: List[FileInfo], dest: List[FileInfo]) -> List[str]:
+    dest_by_path = {file_info.path: file_info for file_info in dest}
+    return [
+        file_info.path
+        for file_info in source
+        if file_info.path not in dest_by_path
+        or file_info.size_bytes != dest_by_path[file_info.path].size_bytes
+        or file_info.mtime != dest_by_path[file_info.path].mtime
+    ]
+
+
+@benchmark("file_listing")
+def file_listing(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    num_files = scaled(200000, scale)
+    entries = [
+        (f"data/case{i // 1000}/{i}.in", 4096 + i % 7, 1.7e9 + i)
+        for i in range(num_files)
+    ]
+    # every 100th file of dest is out of date
+    changed = [
+        (path, size + (i % 100 == 0), mtime)
+        for i, (path, size, mtime) in enumerate(entries)
+    ]
+    builders = {"model": model_listing, "compact": compact_listing}
+    for representation, build in builders.items():
+        params = {"files": num_files, "representation": representation}
+        yield BenchmarkResult(
+            name="file_listing",
+            params={**params, "operation": "build"},
+            seconds=best_of(lambda: build(entries)),
+            operations=num_files,
+            memory_bytes=peak_memory(lambda: build(entries)),
+        )
+    models = (model_listing(entries), model_listing(changed))
+    batches = (compact_listing(entries), compact_listing(changed))
+    params = {"files": num_files, "operation": "diff"}
+    model_seconds = best_of(lambda: diff_models(*models))
+    yield BenchmarkResult(
+        name="file_listing",
+        params={**params, "representation": "model"},
+        seconds=model_seconds,
+        operations=num_files,
+    )
+    # the compact diff must not be slower than diffing the models it replaces
+    yield BenchmarkResult(
+        name="file_listing",
+        params={**params, "representation": "compact"},
+        seconds=best_of(lambda: diff_listings(*batches)),
+        operations=num_files,
+        budget_seconds=model_seconds,
+    )
+
+
+def measure_import_time(module: str) -> float:
+    """Cumulative import time of module in a fresh interpreter (-X importtime)."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PACKAGE_ROOT,
+        stderr=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    for line in process.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6
+    raise ImportError(f"no import time reported for {module}")
+
+
+@benchmark("import_time")
+def import_time(work_dir: str, scale: float) -> Iterator[BenchmarkResult]:
+    for module, budget in IMPORT_TIME_BUDGETS.items():
+        yield BenchmarkResult(
+            name="import_time",
+            params={"module": module},
+            seconds=min(measure_import_time(module) for _ in range(3)),
+            budget_seconds=budget,
+        )
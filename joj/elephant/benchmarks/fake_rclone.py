@@ -0,0 +1,122 @@
+"""
+A stand-in for the rclone binary, supporting sync, copy, check and delete of
+local directories with the same skip logic as rclone (size and mtime), and
+--files-from to restrict them to a list of files.
+
+Usage: rclone <command> --config <file> [flags] <source> <dest>
+"""
+import os
+import shutil
+import stat
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+PACKAGE_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+
+def list_tree(
+    root: str, files_from: Optional[Set[str]] = None
+) -> Dict[str, os.stat_result]:
+    files = {}
+    for dir_path, _, filenames in os.walk(root):
+        for filename in filenames:
+            full_path = os.path.join(dir_path, filename)
+            path = os.path.relpath(full_path, root)
+            if files_from is None or path in files_from:
+                files[path] = os.stat(full_path)
+    return files
+
+
+def is_same(src: os.stat_result, dest: os.stat_result) -> bool:
+    return src.st_size == dest.st_size and int(src.st_mtime) == int(dest.st_mtime)
+
+
+def copy_tree(
+    source: str, dest: str, delete: bool, files_from: Optional[Set[str]] = None
+) -> None:
+    src_files = list_tree(source, files_from)
+    dest_files = list_tree(dest, files_from) if os.path.isdir(dest) else {}
+    for path, src_stat in src_files.items():
+        dest_stat = dest_files.get(path)
+        if dest_stat is not None and is_same(src_stat, dest_stat):
+            continue
+        dest_path = os.path.join(dest, path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copy2(os.path.join(source, path), dest_path)
+    if delete:
+        for path in dest_files.keys() - src_files.keys():
+            os.remove(os.path.join(dest, path))
+
+
+def check_tree(source: str, dest: str, files_from: Optional[Set[str]] = None) -> bool:
+    dest_files = list_tree(dest, files_from)
+    return all(
+        path in dest_files and dest_files[path].st_size == src_stat.st_size
+        for path, src_stat in list_tree(source, files_from).items()
+    )
+
+
+def delete_tree(dest: str, files_from: Optional[Set[str]] = None) -> None:
+    for path in list_tree(dest, files_from):
+        os.remove(os.path.join(dest, path))
+
+
+def parse_args(args: List[str]) -> Tuple[str, List[str], Optional[Set[str]]]:
+    command, positional = args[0], []
+    files_from: Optional[Set[str]] = None
+    rest = iter(args[1:])
+    for arg in rest:
+        if arg == "--config":
+            next(rest)
+        elif arg == "--files-from":
+            with open(next(rest)) as f:
+                files_from = {os.path.normpath(line.strip()) for line in f}
+        elif not arg.startswith("-"):
+            positional.append(arg)
+    return command, positional, files_from
+
+
+def main(args: List[str]) -> int:
+    command, positional, files_from = parse_args(args)
+    if command == "version":
+        print("rclone v0.0.0-fake")
+        return 0
+    if command in ("sync", "copy") and len(positional) == 2:
+        copy_tree(positional[0], positional[1], command == "sync", files_from)
+        return 0
+    if command == "check" and len(positional) == 2:
+        return 0 if check_tree(positional[0], positional[1], files_from) else 1
+    if command == "delete" and len(positional) == 1:
+        delete_tree(positional[0], files_from)
+        return 0
+    print(f"fake rclone: unsupported arguments {args}", file=sys.stderr)
+    return 2
+
+
+@contextmanager
+def install_fake_rclone(bin_dir: str) -> Iterator[str]:
+    """Put an executable rclone running this module first on PATH."""
+    os.makedirs(bin_dir, exist_ok=True)
+    executable = os.path.join(bin_dir, "rclone")
+    with open(executable, "w") as f:
+        f.write(
+            f"#!{sys.executable}\n"
+            "import sys\n"
+            f"sys.path.insert(0, {PACKAGE_ROOT!r})\n"
+            "from joj.elephant.benchmarks.fake_rclone import main\n"
+            "sys.exit(main(sys.argv[1:]))\n"
+        )
+    os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+    old_path = os.environ.get("PATH", "")
+    os.environ["PATH"] = os.pathsep.join([bin_dir, old_path])
+    try:
+        yield executable
+    finally:
+        os.environ["PATH"] = old_path
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
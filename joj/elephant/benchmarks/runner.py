@@ -0,0 +1,151 @@
+import platform
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import orjson
+from pydantic import BaseModel
+
+from joj.elephant.errors import ElephantError
+
+DEFAULT_TOLERANCE = 0.25
+
+
+class BenchmarkResult(BaseModel):
+    name: str
+    params: Dict[str, Any] = {}
+    seconds: float = 0.0
+    operations: int = 1
+    bytes: int = 0
+    budget_seconds: Optional[float] = None
+    # peak of python allocations, reported but not compared
+    memory_bytes: Optional[int] = None
+    skipped: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.name}[{params}]" if params else self.name
+
+
+class BenchmarkReport(BaseModel):
+    python: str = platform.python_version()
+    platform: str = platform.platform()
+    results: List[BenchmarkResult] = []
+
+
+class Regression(BaseModel):
+    key: str
+    baseline_seconds: float
+    seconds: float
+
+
+BenchmarkFunc = Callable[[str, float], Iterator[BenchmarkResult]]
+BENCHMARKS: Dict[str, BenchmarkFunc] = {}
+
+
+def benchmark(name: str) -> Callable[[BenchmarkFunc], BenchmarkFunc]:
+    """Register a benchmark, called with (work_dir, scale)."""
+
+    def decorator(func: BenchmarkFunc) -> BenchmarkFunc:
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def best_of(func: Callable[[], Any], repeat: int = 3) -> float:
+    """Return the fastest wall time of repeat runs of func."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    """Return the peak size of python allocations made while running func."""
+    tracemalloc.start()
+    try:
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def run_benchmarks(
+    work_dir: str, scale: float = 1.0, names: Optional[List[str]] = None
+) -> BenchmarkReport:
+    # register the built-in benchmarks, cases imports this module
+    import joj.elephant.benchmarks.cases  # noqa: F401
+
+    report = BenchmarkReport()
+    for name, func in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        try:
+            report.results.extend(func(work_dir, scale))
+        except (ImportError, ElephantError) as e:
+            report.results.append(BenchmarkResult(name=name, skipped=str(e)))
+    return report
+
+
+def compare_reports(
+    report: BenchmarkReport,
+    baseline: BenchmarkReport,
+    tolerance: float = DEFAULT_TOLERANCE,
+    tolerances: Optional[Dict[str, float]] = None,
+) -> List[Regression]:
+    """
+    Return the results more than tolerance slower than baseline, tolerances
+    can raise the tolerance of noisy benchmarks by name.
+    """
+    baseline_seconds = {
+        result.key: result.seconds
+        for result in baseline.results
+        if result.skipped is None
+    }
+    regressions = []
+    for result in report.results:
+        if result.skipped is not None or result.key not in baseline_seconds:
+            continue
+        allowed = max(tolerance, (tolerances or {}).get(result.name, tolerance))
+        if result.seconds > baseline_seconds[result.key] * (1 + allowed):
+            regressions.append(
+                Regression(
+                    key=result.key,
+                    baseline_seconds=baseline_seconds[result.key],
+                    seconds=result.seconds,
+                )
+            )
+    return regressions
+
+
+def check_budgets(report: BenchmarkReport) -> List[Regression]:
+    """Return the results slower than their absolute budget."""
+    return [
+        Regression(
+            key=result.key,
+            baseline_seconds=result.budget_seconds,
+            seconds=result.seconds,
+        )
+        for result in report.results
+        if result.skipped is None
+        and result.budget_seconds is not None
+        and result.seconds > result.budget_seconds
+    ]
+
+
+def dump_report(report: BenchmarkReport) -> bytes:
+    return orjson.dumps(report.dict(), option=orjson.OPT_INDENT_2)
+
+
+def load_report(data: bytes) -> BenchmarkReport:
+    return BenchmarkReport(**orjson.loads(data))
+
+
+def scaled(value: int, scale: float, minimum: int = 1) -> int:
+    return max(minimum, int(value * scale))
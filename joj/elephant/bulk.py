@@ -0,0 +1,198 @@
+"""
+Validate or sync many problems in parallel worker processes.
+
+A storage is given as a local directory, or like rclone as
+"remote:bucket/prefix" where remote is an s3 section of the rclone config
+(its access_key_id, secret_access_key and endpoint are used for boto3
+too). Every problem is a directory under the source storage.
+"""
+import configparser
+import os
+import platform
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import Enum
+from pathlib import PurePosixPath
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from fs.errors import FSError
+from pydantic import BaseModel
+
+from joj.elephant.errors import FileSystemError
+from joj.elephant.manager import Manager
+from joj.elephant.rclone import RClone
+from joj.elephant.schemas import StrEnumMixin
+from joj.elephant.storage import LocalStorage, S3Storage, Storage
+
+
+class BulkAction(StrEnumMixin, Enum):
+    validate = "validate"
+    sync = "sync"
+
+
+class ProblemResult(BaseModel):
+    problem: str
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+class BulkReport(BaseModel):
+    action: BulkAction
+    source: str
+    dest: Optional[str] = None
+    jobs: int
+    cpus: Optional[int] = os.cpu_count()
+    python: str = platform.python_version()
+    seconds: float = 0.0
+    succeeded: int = 0
+    failed: int = 0
+    results: List[ProblemResult] = []
+
+
+def parse_rclone_config(config: str) -> Dict[str, Dict[str, str]]:
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_string(config)
+    return {section: dict(parser[section]) for section in parser.sections()}
+
+
+def _split_remote(spec: str) -> Optional[Tuple[str, str, str]]:
+    """Split "remote:bucket/prefix", None for a local path."""
+    remote, sep, rest = spec.partition(":")
+    if not sep or os.sep in remote or not remote:
+        return None
+    bucket, _, prefix = rest.strip("/").partition("/")
+    return remote, bucket, prefix
+
+
+def open_storage(
+    spec: str,
+    problem: str,
+    remotes: Dict[str, Dict[str, str]],
+    create: bool = False,
+) -> Storage:
+    """Open the directory of problem ("" for the root) in spec."""
+    remote = _split_remote(spec)
+    if remote is None:
+        path = os.path.join(spec, problem) if problem else spec
+        return LocalStorage(path, create=create)
+    name, bucket, prefix = remote
+    options = remotes.get(name)
+    if options is None:
+        raise FileSystemError(f"remote {name} not found in the rclone config!")
+    if options.get("type") != "s3":
+        raise FileSystemError(f"remote {name} is not of type s3!")
+    dir_path = str(PurePosixPath("/", prefix, problem))
+    return S3Storage(
+        host_in_config=name,
+        bucket_name=bucket,
+        dir_path=dir_path,
+        username=options.get("access_key_id") or None,
+        password=options.get("secret_access_key") or None,
+        endpoint_url=options.get("endpoint") or None,
+    )
+
+
+def list_problems(
+    spec: str, prefix: str, remotes: Dict[str, Dict[str, str]]
+) -> List[str]:
+    """List the problem directories in spec whose names start with prefix."""
+    storage = open_storage(spec, "", remotes)
+    try:
+        return sorted(
+            info.name
+            for info in storage.fs.scandir("/")
+            if info.is_dir and info.name.startswith(prefix)
+        )
+    except FSError as e:
+        raise FileSystemError(str(e))
+    finally:
+        storage.close()
+
+
+class _Worker:
+    """State of a worker process, reused by all its problems."""
+
+    rclone: RClone
+    remotes: Dict[str, Dict[str, str]]
+
+
+_worker = _Worker()
+
+
+def _init_worker(rclone_config: str) -> None:
+    _worker.rclone = RClone(rclone_config)
+    _worker.remotes = parse_rclone_config(rclone_config)
+
+
+def _run_problem(
+    action: BulkAction, source_spec: str, dest_spec: Optional[str], problem: str
+) -> ProblemResult:
+    start = time.perf_counter()
+    source = dest = None
+    try:
+        source = open_storage(source_spec, problem, _worker.remotes)
+        if dest_spec is not None:
+            dest = open_storage(dest_spec, problem, _worker.remotes, create=True)
+        manager = Manager(_worker.rclone, source, dest)
+        if action == BulkAction.validate:
+            manager.validate_source()
+        else:
+            manager.sync_with_validation()
+    except Exception as e:
+        # any failure is reported for its problem, never kills the whole run
+        return ProblemResult(
+            problem=problem,
+            ok=False,
+            seconds=time.perf_counter() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+    finally:
+        for storage in (source, dest):
+            if storage is not None:
+                storage.close()
+    return ProblemResult(problem=problem, ok=True, seconds=time.perf_counter() - start)
+
+
+def run_bulk(
+    action: BulkAction,
+    source: str,
+    problems: Iterable[str],
+    dest: Optional[str] = None,
+    jobs: Optional[int] = None,
+    rclone_config: str = "",
+    on_result: Optional[Callable[[ProblemResult, int, int], None]] = None,
+) -> BulkReport:
+    """
+    Run action for every problem on a pool of jobs processes (default: one
+    per cpu). on_result is called with (result, done, total) as problems
+    finish.
+    """
+    if action == BulkAction.sync and dest is None:
+        raise FileSystemError("sync needs a destination!")
+    jobs = jobs or os.cpu_count() or 1
+    problems = list(problems)
+    report = BulkReport(action=action, source=source, dest=dest, jobs=jobs)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(rclone_config,)
+    ) as executor:
+        futures = [
+            executor.submit(_run_problem, action, source, dest, problem)
+            for problem in problems
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            report.results.append(result)
+            if on_result is not None:
+                on_result(result, len(report.results), len(problems))
+    report.seconds = time.perf_counter() - start
+    report.results.sort(key=lambda result: result.problem)
+    report.succeeded = sum(result.ok for result in report.results)
+    report.failed = len(report.results) - report.succeeded
+    return report
+
+
+def dump_report(report: BulkReport) -> bytes:
+    return orjson.dumps(report.dict(), option=orjson.OPT_INDENT_2)
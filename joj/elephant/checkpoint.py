@@ -0,0 +1,77 @@
+import os
+import tempfile
+from hashlib import sha256
+from typing import Any, Dict, Optional
+
+import orjson
+from loguru import logger
+from pydantic import ValidationError
+
+from joj.elephant.schemas import TransferCheckpoint
+
+DEFAULT_CHECKPOINT_DIR = os.path.join(tempfile.gettempdir(), "joj-elephant-checkpoints")
+
+
+def dump_json(file_path: str, value: Dict[str, Any]) -> None:
+    """Write a json file atomically, readers never see a partial file."""
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(orjson.dumps(value))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+
+class CheckpointStore:
+    """
+    Persist the progress of resumable transfers as one json file per transfer,
+    so that a retry (even in another process) continues where the last stopped.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = directory or DEFAULT_CHECKPOINT_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(
+            self.directory, sha256(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    @staticmethod
+    def get_source_checkpoint(source: str) -> TransferCheckpoint:
+        """Create an empty checkpoint which identifies the local source file."""
+        stat = os.stat(source)
+        return TransferCheckpoint(
+            source=os.path.abspath(source),
+            size_bytes=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+        )
+
+    def load(self, key: str, source: str) -> Optional[TransferCheckpoint]:
+        """Load the checkpoint of key, None if missing or source has changed."""
+        try:
+            with open(self._get_file_path(key), "rb") as f:
+                checkpoint = TransferCheckpoint(**orjson.loads(f.read()))
+        except FileNotFoundError:
+            return None
+        except (orjson.JSONDecodeError, ValidationError, TypeError):
+            logger.warning("broken checkpoint of {} ignored", key)
+            return None
+        current = self.get_source_checkpoint(source)
+        if (
+            checkpoint.source != current.source
+            or checkpoint.size_bytes != current.size_bytes
+            or checkpoint.mtime_ns != current.mtime_ns
+        ):
+            logger.info("source of {} changed, checkpoint ignored", key)
+            return None
+        return checkpoint
+
+    def save(self, key: str, checkpoint: TransferCheckpoint) -> None:
+        dump_json(self._get_file_path(key), checkpoint.dict())
+
+    def remove(self, key: str) -> None:
+        try:
+            os.remove(self._get_file_path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,284 @@
+"""
+Transparent zstd compression of the objects of any Storage.
+
+An object is stored as a single zstd frame, or raw when a sample of it does
+not compress well. The zstd magic number identifies compressed objects, so
+they are readable on every backend; backends with object metadata (S3) also
+get the codec and the logical size as metadata, which saves a read in
+getinfo. Raw data starting with the magic number is always compressed.
+
+Only the Storage methods are wrapped: an rclone sync of the inner storage
+moves the stored (compressed) bytes, to be read by a CompressedStorage on
+the other side. Requires the zstandard package (the compression extra).
+"""
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+from typing import Any, BinaryIO, Dict, Optional, cast
+
+from fs.errors import FSError
+
+from joj.elephant.checkpoint import CheckpointStore
+from joj.elephant.delta import DELTA_BLOCK_SIZE, SignatureStore
+from joj.elephant.errors import FileSystemError
+from joj.elephant.listing import FileInfoBatch
+from joj.elephant.metrics import instrument, record_bytes
+from joj.elephant.schemas import FileInfo
+from joj.elephant.storage import (
+    COPY_CHUNK_SIZE,
+    RESUMABLE_CHUNK_SIZE,
+    SPILL_THRESHOLD,
+    Storage,
+)
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# the longest zstd frame header
+ZSTD_HEADER_SIZE = 18
+
+CODEC_KEY = "elephant-codec"
+SIZE_KEY = "elephant-size"
+
+DEFAULT_LEVEL = 3
+DEFAULT_MIN_RATIO = 0.9
+SAMPLE_SIZE = 256 * 1024
+
+
+class _PrefixedReader:
+    """Read prefix, then the rest of file, counting the bytes read."""
+
+    def __init__(self, prefix: bytes, file: BinaryIO) -> None:
+        self.prefix = prefix
+        self.file = file
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self.prefix:
+            if size < 0:
+                data = self.prefix + self.file.read()
+            else:
+                data = self.prefix[:size]
+            self.prefix = self.prefix[len(data) :]
+        else:
+            data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class CompressedStorage(Storage):
+    """
+    Compress objects of storage with zstd on upload and decompress them on
+    download, reporting logical (uncompressed) sizes in FileInfo.
+
+    Objects are compressed if the first SAMPLE_SIZE bytes shrink to
+    min_ratio of their size or less.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        level: int = DEFAULT_LEVEL,
+        min_ratio: float = DEFAULT_MIN_RATIO,
+    ) -> None:
+        import zstandard
+
+        super().__init__(path=storage.path)
+        self.storage = storage
+        self.level = level
+        self.min_ratio = min_ratio
+        self._zstd = zstandard
+        self._fs = storage.fs
+
+    def getsyspath(self, path: Path) -> Optional[str]:
+        # a local file holds the stored bytes, not the logical ones
+        return None
+
+    @instrument("getinfo")
+    def getinfo(self, path: Path) -> FileInfo:
+        file_info = self.storage.getinfo(path)
+        if file_info.is_dir:
+            return file_info
+        codec = file_info.metadata.get(CODEC_KEY)
+        if codec is None:
+            header = self.storage.read_range(path, 0, ZSTD_HEADER_SIZE)
+            codec = "zstd" if header.startswith(ZSTD_MAGIC) else "none"
+            if codec == "zstd":
+                try:
+                    size = self._zstd.frame_content_size(header)
+                except self._zstd.ZstdError as e:
+                    raise FileSystemError(f"broken zstd frame of {path}: {e}")
+                # -1: the size was unknown on upload
+                file_info.size_bytes = size if size >= 0 else None
+        elif codec == "zstd":
+            size_str = file_info.metadata.get(SIZE_KEY)
+            file_info.size_bytes = int(size_str) if size_str else None
+        file_info.metadata = {**file_info.metadata, CODEC_KEY: codec}
+        if codec == "zstd":
+            # the etag of the stored bytes says nothing about the content
+            file_info.checksum = None
+        return file_info
+
+    @instrument("list_compact")
+    def list_compact(self, path: Path = Path("/")) -> FileInfoBatch:
+        """
+        The listing of storage with the logical size (and checksum) of every
+        file from getinfo, so one more read per file.
+        """
+        batch = FileInfoBatch()
+        for entry in self.storage.list_compact(path):
+            if entry.is_dir:
+                batch.append(entry.path, is_dir=True, mtime_ns=entry.mtime_ns)
+                continue
+            file_info = self.getinfo(path / entry.path)
+            batch.append(
+                entry.path,
+                size_bytes=file_info.size_bytes,
+                mtime_ns=entry.mtime_ns,
+                checksum=file_info.checksum,
+            )
+        return batch
+
+    def _is_compressible(self, sample: bytes) -> bool:
+        if sample.startswith(ZSTD_MAGIC):
+            return True
+        if not sample:
+            return False
+        compressed = self._zstd.ZstdCompressor(level=self.level).compress(sample)
+        return len(compressed) <= len(sample) * self.min_ratio
+
+    @instrument("upload")
+    def upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        size: Optional[int] = None
+        if file.seekable():
+            position = file.tell()
+            size = file.seek(0, 2) - position
+            file.seek(position)
+        sample = file.read(SAMPLE_SIZE)
+        reader = _PrefixedReader(sample, file)
+        metadata = dict(metadata or {})
+        if self._is_compressible(sample):
+            compressor = self._zstd.ZstdCompressor(
+                level=self.level, write_content_size=True
+            )
+            stream: Any = compressor.stream_reader(
+                cast(BinaryIO, reader), size=-1 if size is None else size
+            )
+            metadata[CODEC_KEY] = "zstd"
+            if size is not None:
+                metadata[SIZE_KEY] = str(size)
+        else:
+            stream = reader
+            metadata[CODEC_KEY] = "none"
+        file_info = self.storage.upload(path, stream, chunk_size, metadata)
+        stored_bytes = file_info.size_bytes
+        file_info.size_bytes = reader.bytes_read
+        file_info.metadata = metadata
+        if metadata[CODEC_KEY] == "zstd":
+            file_info.checksum = None
+        record_bytes(stored_bytes or 0)
+        return file_info
+
+    @instrument("download")
+    def download(
+        self, path: Path, file: BinaryIO, chunk_size: Optional[int] = None
+    ) -> None:
+        chunk_size = chunk_size or COPY_CHUNK_SIZE
+        try:
+            src = self.fs.openbin(str(path), mode="r")
+        except FSError as e:
+            raise FileSystemError(str(e))
+        with src:
+            head = src.read(chunk_size)
+            record_bytes(len(head))
+            if not head.startswith(ZSTD_MAGIC):
+                file.write(head)
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    record_bytes(len(chunk))
+                    file.write(chunk)
+                return
+            decompressor = self._zstd.ZstdDecompressor().decompressobj()
+            try:
+                file.write(decompressor.decompress(head))
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    record_bytes(len(chunk))
+                    file.write(decompressor.decompress(chunk))
+            except self._zstd.ZstdError as e:
+                raise FileSystemError(f"failed to decompress {path}: {e}")
+
+    @instrument("read_range")
+    def read_range(
+        self, path: Path, offset: int, length: Optional[int] = None
+    ) -> bytes:
+        if length == 0:
+            return b""
+        head = self.storage.read_range(path, 0, ZSTD_HEADER_SIZE)
+        if not head.startswith(ZSTD_MAGIC):
+            return self.storage.read_range(path, offset, length)
+        try:
+            src = self.fs.openbin(str(path), mode="r")
+        except FSError as e:
+            raise FileSystemError(str(e))
+        with src, self._zstd.ZstdDecompressor().stream_reader(src) as reader:
+            try:
+                # streams are not seekable backwards, skip by reading
+                reader.seek(offset)
+                data = reader.read(-1 if length is None else length)
+            except self._zstd.ZstdError as e:
+                raise FileSystemError(f"failed to decompress {path}: {e}")
+        record_bytes(len(data))
+        return data
+
+    def copy_to(
+        self,
+        path: Path,
+        dest: Storage,
+        dest_path: Optional[Path] = None,
+        delta: bool = False,
+    ) -> FileInfo:
+        """Copy the logical content of a file to another storage."""
+        with SpooledTemporaryFile(max_size=SPILL_THRESHOLD) as f:
+            file = cast(BinaryIO, f)
+            self.download(path, file)
+            file.seek(0)
+            return dest.upload(path if dest_path is None else dest_path, file)
+
+    def upload_resumable(
+        self,
+        path: Path,
+        source: str,
+        checkpoints: Optional[CheckpointStore] = None,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+    ) -> FileInfo:
+        """A compressed stream can not be resumed, upload it in one go."""
+        with open(source, "rb") as f:
+            return self.upload(path, f)
+
+    def upload_delta(
+        self,
+        path: Path,
+        source: str,
+        signatures: Optional[SignatureStore] = None,
+        block_size: int = DELTA_BLOCK_SIZE,
+    ) -> FileInfo:
+        """Blocks of compressed objects can not be reused, upload in one go."""
+        with open(source, "rb") as f:
+            return self.upload(path, f)
+
+    def delete(self, path: Path) -> FileInfo:
+        return self.storage.delete(path)
+
+    def delete_dir(self, path: Path) -> FileInfo:
+        return self.storage.delete_dir(path)
+
+    def delete_tree(self, path: Path) -> FileInfo:
+        return self.storage.delete_tree(path)
+
+    def close(self) -> None:
+        self.storage.close()
+
+    def extract_all(self) -> None:
+        self.storage.extract_all()
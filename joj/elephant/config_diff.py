@@ -0,0 +1,228 @@
+"""
+Structured diff of two problem configs, to re-judge and re-sync only what a
+config edit affected.
+
+Defaults are resolved first (language_default into languages, case_default
+into cases), so moving a value into a default is not a change. Languages are
+matched by name and cases by their position in the language, which is how
+case results are numbered.
+"""
+import posixpath
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from joj.elephant.schemas import Case, Config, DiffType, Language, LanguageDefault
+
+CASE_FILE_FIELDS = ("execute_files", "execute_input_file", "execute_output_file")
+LANGUAGE_FILE_FIELDS = ("compile_files",)
+LANGUAGE_FIELDS = tuple(
+    field for field in Language.__fields__ if field not in ("case_default", "cases")
+)
+CASE_FIELDS = tuple(Case.__fields__)
+
+
+class CaseDiff(BaseModel):
+    index: int
+    type: DiffType
+    # changed fields, and referenced files whose content changed
+    fields: List[str] = []
+    files: List[str] = []
+
+
+class LanguageDiff(BaseModel):
+    name: str
+    type: DiffType
+    fields: List[str] = []
+    files: List[str] = []
+    cases: List[CaseDiff] = []
+
+
+class ConfigDiff(BaseModel):
+    languages: List[LanguageDiff] = []
+    # files referenced by the new config only, by the old one only, and
+    # referenced files whose content changed
+    added_files: List[str] = []
+    removed_files: List[str] = []
+    changed_files: List[str] = []
+
+    @property
+    def empty(self) -> bool:
+        return not (self.languages or self.added_files or self.removed_files)
+
+    def rejudge_cases(self) -> Dict[str, List[int]]:
+        """Indexes of the cases (of the new config) to judge again by language."""
+        result = {}
+        for language in self.languages:
+            if language.type == DiffType.removed:
+                continue
+            indexes = [
+                case.index for case in language.cases if case.type != DiffType.removed
+            ]
+            if indexes:
+                result[language.name] = indexes
+        return result
+
+    def sync_files(self) -> List[str]:
+        """Files to sync again: newly referenced or changed."""
+        return sorted({*self.added_files, *self.changed_files})
+
+
+@lru_cache(maxsize=65536)
+def _normalize(path: str) -> str:
+    return posixpath.normpath(path).lstrip("/")
+
+
+def _referenced(values: Dict[str, Any], fields: Tuple[str, ...]) -> Set[str]:
+    files = set()
+    for field in fields:
+        value = values.get(field)
+        if isinstance(value, str):
+            files.add(_normalize(value))
+        elif value:
+            files.update(_normalize(path) for path in value)
+    return files
+
+
+def _changed_fields(
+    old: Dict[str, Any], new: Dict[str, Any], fields: Tuple[str, ...]
+) -> List[str]:
+    return [field for field in fields if old.get(field) != new.get(field)]
+
+
+def _language_dict(language: Optional[LanguageDefault]) -> Optional[Dict[str, Any]]:
+    """A shallow Config.dict() of language, much faster for many cases."""
+    if language is None:
+        return None
+    values = dict(language.__dict__)
+    if language.case_default is not None:
+        values["case_default"] = language.case_default.__dict__
+    if language.cases is not None:
+        values["cases"] = [case.__dict__ for case in language.cases]
+    return values
+
+
+def _languages_by_key(config: Config) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """Resolved languages by (name, occurrence of the name)."""
+    values = Config.parse_defaults_dict(
+        {
+            "languages": [_language_dict(language) for language in config.languages],
+            "language_default": _language_dict(config.language_default),
+        }
+    )
+    result: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for language in values["languages"]:
+        occurrence = 0
+        while (language["name"], occurrence) in result:
+            occurrence += 1
+        result[(language["name"], occurrence)] = language
+    return result
+
+
+def _diff_cases(
+    old_cases: List[Dict[str, Any]],
+    new_cases: List[Dict[str, Any]],
+    changed_files: Set[str],
+) -> List[CaseDiff]:
+    diffs = []
+    for index in range(max(len(old_cases), len(new_cases))):
+        if index >= len(old_cases):
+            diffs.append(CaseDiff(index=index, type=DiffType.added))
+        elif index >= len(new_cases):
+            diffs.append(CaseDiff(index=index, type=DiffType.removed))
+        else:
+            old, new = old_cases[index], new_cases[index]
+            fields = [] if old == new else _changed_fields(old, new, CASE_FIELDS)
+            files = []
+            if changed_files:
+                files = sorted(_referenced(new, CASE_FILE_FIELDS) & changed_files)
+            if fields or files:
+                diffs.append(
+                    CaseDiff(
+                        index=index, type=DiffType.changed, fields=fields, files=files
+                    )
+                )
+    return diffs
+
+
+def _diff_language(
+    name: str,
+    old: Optional[Dict[str, Any]],
+    new: Optional[Dict[str, Any]],
+    changed_files: Set[str],
+) -> Optional[LanguageDiff]:
+    if old is None or new is None:
+        language = old if new is None else new
+        assert language is not None
+        return LanguageDiff(
+            name=name,
+            type=DiffType.removed if new is None else DiffType.added,
+            cases=[
+                CaseDiff(
+                    index=index,
+                    type=DiffType.removed if new is None else DiffType.added,
+                )
+                for index in range(len(language["cases"]))
+            ],
+        )
+    fields = _changed_fields(old, new, LANGUAGE_FIELDS)
+    files = sorted(_referenced(new, LANGUAGE_FILE_FIELDS) & changed_files)
+    if fields or files:
+        # a new compile step changes the result of every case
+        cases = [
+            CaseDiff(index=index, type=DiffType.changed)
+            for index in range(len(new["cases"]))
+        ]
+        cases += [
+            CaseDiff(index=index, type=DiffType.removed)
+            for index in range(len(new["cases"]), len(old["cases"]))
+        ]
+    else:
+        cases = _diff_cases(old["cases"], new["cases"], changed_files)
+        if not cases:
+            return None
+    return LanguageDiff(
+        name=name, type=DiffType.changed, fields=fields, files=files, cases=cases
+    )
+
+
+def _referenced_by_languages(languages: Iterable[Dict[str, Any]]) -> Set[str]:
+    files = set()
+    for language in languages:
+        files |= _referenced(language, LANGUAGE_FILE_FIELDS)
+        for case in language["cases"]:
+            files |= _referenced(case, CASE_FILE_FIELDS)
+    return files
+
+
+def referenced_files(config: Config) -> Set[str]:
+    """Files referenced by the resolved languages and cases of config."""
+    return _referenced_by_languages(_languages_by_key(config).values())
+
+
+def diff_configs(
+    old: Config, new: Config, changed_files: Iterable[str] = ()
+) -> ConfigDiff:
+    """
+    Diff old and new after resolving their defaults. changed_files are the
+    paths whose content changed (e.g. from a storage diff), the cases and
+    languages referencing them are reported as changed too.
+    """
+    changed = {_normalize(path) for path in changed_files}
+    old_languages = _languages_by_key(old)
+    new_languages = _languages_by_key(new)
+    diff = ConfigDiff()
+    for key in [*new_languages, *(k for k in old_languages if k not in new_languages)]:
+        language_diff = _diff_language(
+            key[0], old_languages.get(key), new_languages.get(key), changed
+        )
+        if language_diff is not None:
+            diff.languages.append(language_diff)
+
+    old_files = _referenced_by_languages(old_languages.values())
+    new_files = _referenced_by_languages(new_languages.values())
+    diff.added_files = sorted(new_files - old_files)
+    diff.removed_files = sorted(old_files - new_files)
+    diff.changed_files = sorted(new_files & changed)
+    return diff
@@ -0,0 +1,218 @@
+"""
+Block-level delta transfer (the rsync algorithm).
+
+The signatures (weak adler32 + strong md5 of every block) of the last version
+uploaded are kept in a local sidecar file. A new version is split into blocks
+found in the old object (copied on the remote side) and literal data (sent),
+so a small edit of a large file costs about one block of upload.
+"""
+import os
+import tempfile
+import zlib
+from hashlib import md5, sha256
+from typing import Dict, List, NamedTuple, Optional
+
+import orjson
+from loguru import logger
+from pydantic import ValidationError
+
+from joj.elephant.checkpoint import dump_json
+from joj.elephant.schemas import BlockSignatures
+
+DEFAULT_SIGNATURE_DIR = os.path.join(tempfile.gettempdir(), "joj-elephant-signatures")
+
+DELTA_BLOCK_SIZE = 1024 * 1024
+DELTA_SEARCH_LIMIT = 1024 * 1024 * 8
+
+_ADLER_MOD = 65521
+
+
+class DeltaOp(NamedTuple):
+    offset: int
+    length: int
+    # offset of the same bytes in the old object, None for literal data
+    source_offset: Optional[int] = None
+
+
+def compute_signatures(data: memoryview, block_size: int) -> BlockSignatures:
+    weak = []
+    strong = []
+    for offset in range(0, len(data), block_size):
+        block = data[offset : offset + block_size]
+        weak.append(zlib.adler32(block))
+        strong.append(md5(block).hexdigest())
+    return BlockSignatures(
+        block_size=block_size, size_bytes=len(data), weak=weak, strong=strong
+    )
+
+
+def _append(ops: List[DeltaOp], op: DeltaOp) -> None:
+    """Append op, merged with the last one if they are contiguous."""
+    if ops:
+        last = ops[-1]
+        if (last.source_offset is None and op.source_offset is None) or (
+            last.source_offset is not None
+            and op.source_offset is not None
+            and last.source_offset + last.length == op.source_offset
+        ):
+            ops[-1] = last._replace(length=last.length + op.length)
+            return
+    ops.append(op)
+
+
+def compute_delta(
+    data: memoryview,
+    signatures: BlockSignatures,
+    search_limit: int = DELTA_SEARCH_LIMIT,
+) -> List[DeltaOp]:
+    """
+    Describe data as ranges of the old object (by signatures) and literals.
+
+    Blocks are first matched in place. After a miss the next block boundary of
+    the old object is searched byte by byte with a rolling checksum, which
+    finds data shifted by insertions or deletions; as the rolling search runs
+    in python, it stops after search_limit bytes in total.
+    """
+    block_size = signatures.block_size
+    size = len(data)
+    index: Dict[int, List[int]] = {}
+    for i, weak in enumerate(signatures.weak):
+        index.setdefault(weak, []).append(i)
+
+    def find(offset: int, weak: int) -> Optional[int]:
+        block = data[offset : offset + block_size]
+        strong = None
+        for i in index.get(weak, ()):
+            if min(block_size, signatures.size_bytes - i * block_size) != len(block):
+                continue
+            if strong is None:
+                strong = md5(block).hexdigest()
+            if signatures.strong[i] == strong:
+                return i * block_size
+        return None
+
+    ops: List[DeltaOp] = []
+    offset = 0
+    searched = 0
+    while offset < size:
+        window = data[offset : offset + block_size]
+        source_offset = find(offset, zlib.adler32(window))
+        if source_offset is not None:
+            _append(ops, DeltaOp(offset, len(window), source_offset))
+            offset += len(window)
+            continue
+        next_offset = offset + block_size
+        next_window = data[next_offset : next_offset + block_size]
+        # an edit in place: the next block still matches where it was
+        if (
+            next_offset >= size
+            or not index
+            or searched >= search_limit
+            or find(next_offset, zlib.adler32(next_window)) is not None
+        ):
+            _append(ops, DeltaOp(offset, len(window)))
+            offset += len(window)
+            continue
+        # roll the adler32 of a full window through the block
+        checksum = zlib.adler32(window)
+        a = checksum & 0xFFFF
+        b = checksum >> 16
+        end = min(next_offset, size - block_size)
+        found = next_offset
+        position = offset
+        while position < end:
+            out_byte = data[position]
+            in_byte = data[position + block_size]
+            position += 1
+            a = (a - out_byte + in_byte) % _ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % _ADLER_MOD
+            weak = (b << 16) | a
+            if weak in index and find(position, weak) is not None:
+                found = position
+                break
+        searched += position - offset
+        _append(ops, DeltaOp(offset, found - offset))
+        offset = found
+    return ops
+
+
+def group_parts(
+    ops: List[DeltaOp], min_size: int, max_literal_size: int, max_copy_size: int
+) -> List[DeltaOp]:
+    """
+    Group ops into parts of a multipart upload: every part but the last has
+    at least min_size bytes, copies shorter than that are sent as literals.
+    """
+    parts: List[DeltaOp] = []
+    pending: Optional[DeltaOp] = None
+
+    def add_literal(offset: int, length: int) -> None:
+        nonlocal pending
+        if pending is None:
+            pending = DeltaOp(offset, length)
+        else:
+            pending = pending._replace(length=pending.length + length)
+        while pending.length > max_literal_size:
+            parts.append(pending._replace(length=max_literal_size))
+            pending = DeltaOp(
+                pending.offset + max_literal_size, pending.length - max_literal_size
+            )
+
+    for offset, length, source_offset in ops:
+        if source_offset is None:
+            add_literal(offset, length)
+            continue
+        if pending is not None and pending.length < min_size:
+            size = min(length, min_size - pending.length)
+            add_literal(offset, size)
+            offset += size
+            source_offset += size
+            length -= size
+        if length < min_size:
+            if length:
+                add_literal(offset, length)
+            continue
+        if pending is not None:
+            parts.append(pending)
+            pending = None
+        # split evenly, so that no piece is below min_size
+        count = -(-length // max_copy_size)
+        for i in range(count):
+            start = length * i // count
+            piece = length * (i + 1) // count - start
+            parts.append(DeltaOp(offset + start, piece, source_offset + start))
+    if pending is not None:
+        parts.append(pending)
+    return parts
+
+
+class SignatureStore:
+    """Keep the block signatures of uploaded files, one json file per file."""
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = directory or DEFAULT_SIGNATURE_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(
+            self.directory, sha256(key.encode("utf-8")).hexdigest() + ".json"
+        )
+
+    def load(self, key: str) -> Optional[BlockSignatures]:
+        try:
+            with open(self._get_file_path(key), "rb") as f:
+                return BlockSignatures(**orjson.loads(f.read()))
+        except FileNotFoundError:
+            return None
+        except (orjson.JSONDecodeError, ValidationError, TypeError):
+            logger.warning("broken signatures of {} ignored", key)
+            return None
+
+    def save(self, key: str, signatures: BlockSignatures) -> None:
+        dump_json(self._get_file_path(key), signatures.dict())
+
+    def remove(self, key: str) -> None:
+        try:
+            os.remove(self._get_file_path(key))
+        except FileNotFoundError:
+            pass
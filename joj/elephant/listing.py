@@ -0,0 +1,222 @@
+"""
+Compact file listings for trees with millions of entries.
+
+A FileInfoBatch stores entries in columns (arrays of sizes and mtimes in
+integer nanoseconds, a bytearray of flags) with every directory prefix
+stored once, instead of one validated pydantic FileInfo per entry. Entries
+are read as slotted CompactFileInfo and converted to FileInfo only where an
+API returns them.
+"""
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from joj.elephant.schemas import DiffEntry, DiffType, FileInfo
+
+# sizes and mtimes not reported by the backend
+UNKNOWN = -1
+
+
+def to_mtime_ns(mtime: Union[datetime, float, str]) -> int:
+    """Integer nanoseconds of an epoch, a datetime or an iso string."""
+    if isinstance(mtime, str):
+        mtime = datetime.fromisoformat(mtime)
+    if isinstance(mtime, datetime):
+        if mtime.tzinfo is None:
+            mtime = mtime.replace(tzinfo=timezone.utc)
+        mtime = mtime.timestamp()
+    return int(mtime * 1e9)
+
+
+class CompactFileInfo:
+    __slots__ = ("path", "is_dir", "size_bytes", "mtime_ns", "checksum")
+
+    def __init__(
+        self,
+        path: str,
+        is_dir: bool = False,
+        size_bytes: Optional[int] = None,
+        mtime_ns: Optional[int] = None,
+        checksum: Optional[str] = None,
+    ) -> None:
+        self.path = path
+        self.is_dir = is_dir
+        self.size_bytes = size_bytes
+        self.mtime_ns = mtime_ns
+        self.checksum = checksum
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactFileInfo(path={self.path!r}, is_dir={self.is_dir}, "
+            f"size_bytes={self.size_bytes}, mtime_ns={self.mtime_ns}, "
+            f"checksum={self.checksum!r})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactFileInfo):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def to_file_info(self) -> FileInfo:
+        mtime = None
+        if self.mtime_ns is not None:
+            mtime = datetime.fromtimestamp(self.mtime_ns / 1e9, tz=timezone.utc)
+        return FileInfo(
+            path=self.path,
+            is_dir=self.is_dir,
+            checksum=self.checksum,
+            mtime=mtime,
+            size_bytes=self.size_bytes,
+        )
+
+
+class FileInfoBatch:
+    """Columnar FileInfo entries, paths are relative to the listed directory."""
+
+    def __init__(self) -> None:
+        self.dirs: List[str] = []
+        self._dir_ids: Dict[str, int] = {}
+        self.dir_ids = array("I")
+        self.names: List[str] = []
+        self.is_dir = bytearray()
+        self.sizes = array("q")
+        self.mtimes_ns = array("q")
+        # allocated when the first checksum is appended
+        self.checksums: Optional[List[Optional[str]]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def append(
+        self,
+        path: str,
+        is_dir: bool = False,
+        size_bytes: Optional[int] = None,
+        mtime_ns: Optional[int] = None,
+        checksum: Optional[str] = None,
+    ) -> None:
+        dir_path, _, name = path.rpartition("/")
+        dir_id = self._dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self._dir_ids[dir_path] = len(self.dirs)
+            self.dirs.append(dir_path)
+        self.dir_ids.append(dir_id)
+        self.names.append(name)
+        self.is_dir.append(is_dir)
+        self.sizes.append(UNKNOWN if size_bytes is None else size_bytes)
+        self.mtimes_ns.append(UNKNOWN if mtime_ns is None else mtime_ns)
+        if checksum is not None and self.checksums is None:
+            self.checksums = [None] * (len(self.names) - 1)
+        if self.checksums is not None:
+            self.checksums.append(checksum)
+
+    def path(self, index: int) -> str:
+        dir_path = self.dirs[self.dir_ids[index]]
+        name = self.names[index]
+        return f"{dir_path}/{name}" if dir_path else name
+
+    def paths(self) -> Iterator[str]:
+        return (self.path(index) for index in range(len(self)))
+
+    def __getitem__(self, index: int) -> CompactFileInfo:
+        size = self.sizes[index]
+        mtime_ns = self.mtimes_ns[index]
+        return CompactFileInfo(
+            path=self.path(index),
+            is_dir=bool(self.is_dir[index]),
+            size_bytes=None if size == UNKNOWN else size,
+            mtime_ns=None if mtime_ns == UNKNOWN else mtime_ns,
+            checksum=None if self.checksums is None else self.checksums[index],
+        )
+
+    def __iter__(self) -> Iterator[CompactFileInfo]:
+        return (self[index] for index in range(len(self)))
+
+    @classmethod
+    def from_file_infos(cls, file_infos: Iterable[FileInfo]) -> "FileInfoBatch":
+        batch = cls()
+        for file_info in file_infos:
+            batch.append(
+                file_info.path.lstrip("/"),
+                is_dir=file_info.is_dir,
+                size_bytes=file_info.size_bytes,
+                mtime_ns=(
+                    None if file_info.mtime is None else to_mtime_ns(file_info.mtime)
+                ),
+                checksum=file_info.checksum,
+            )
+        return batch
+
+    def to_file_infos(self) -> List[FileInfo]:
+        return [entry.to_file_info() for entry in self]
+
+
+def diff_listings(source: FileInfoBatch, dest: FileInfoBatch) -> List[DiffEntry]:
+    """
+    Files to add to, remove from or change in dest to match source. Files
+    differ by size, then by checksum when both have one, else by mtime in
+    seconds (like rclone, backends keep mtimes with different precisions).
+    """
+    # dest files by name in each directory, paths are only built for changes
+    dest_names: List[Dict[str, int]] = [{} for _ in dest.dirs]
+    for index, dir_id, name in zip(range(len(dest)), dest.dir_ids, dest.names):
+        dest_names[dir_id][name] = index
+    index = dest.is_dir.find(1)
+    while index != -1:
+        del dest_names[dest.dir_ids[index]][dest.names[index]]
+        index = dest.is_dir.find(1, index + 1)
+    # the names of a source directory missing from dest
+    missing: Dict[str, int] = {}
+    source_dirs = [
+        dest_names[dest._dir_ids[dir_path]] if dir_path in dest._dir_ids else missing
+        for dir_path in source.dirs
+    ]
+    dest_sizes, dest_mtimes = dest.sizes, dest.mtimes_ns
+    source_checksums, dest_checksums = source.checksums, dest.checksums
+    changes = []
+    for index, dir_id, name, is_dir, size, mtime in zip(
+        range(len(source)),
+        source.dir_ids,
+        source.names,
+        source.is_dir,
+        source.sizes,
+        source.mtimes_ns,
+    ):
+        if is_dir:
+            continue
+        other = source_dirs[dir_id].pop(name, None)
+        if other is None:
+            change_type = DiffType.added
+        elif size != dest_sizes[other]:
+            change_type = DiffType.changed
+        elif (
+            source_checksums is not None
+            and dest_checksums is not None
+            and source_checksums[index] is not None
+            and dest_checksums[other] is not None
+        ):
+            if source_checksums[index] == dest_checksums[other]:
+                continue
+            change_type = DiffType.changed
+        else:
+            other_mtime = dest_mtimes[other]
+            if (
+                mtime == other_mtime
+                or mtime == UNKNOWN
+                or other_mtime == UNKNOWN
+                or mtime // 1000000000 == other_mtime // 1000000000
+            ):
+                continue
+            change_type = DiffType.changed
+        changes.append(
+            DiffEntry(
+                type=change_type,
+                path=source.path(index),
+                size_bytes=None if size == UNKNOWN else size,
+            )
+        )
+    removed = sorted(index for names in dest_names for index in names.values())
+    changes.extend(
+        DiffEntry(type=DiffType.removed, path=dest.path(index)) for index in removed
+    )
+    return changes
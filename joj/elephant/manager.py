@@ -1,13 +1,12 @@
 from os.path import dirname
 from pathlib import Path
-from typing import IO, Any, Callable, Optional, Tuple
+from threading import Event
+from typing import IO, TYPE_CHECKING, Any, Callable, Optional, Tuple
 
 import orjson
 from fs.errors import FSError
-from gitignore_parser import handle_negation, rule_from_pattern
 from loguru import logger
 
-from joj.elephant.archive import Archive, TgzArchive, ZipArchive
 from joj.elephant.errors import (
     ArchiveError,
     ConfigError,
@@ -15,14 +14,29 @@ from joj.elephant.errors import (
     FileSystemSyncError,
     FileSystemUndefinedError,
 )
+from joj.elephant.metrics import instrument
 from joj.elephant.rclone import RClone
 from joj.elephant.schemas import ArchiveType, Config
-from joj.elephant.storage import LocalStorage, S3Storage, Storage, TempStorage
+from joj.elephant.storage import (
+    LakeFSStorage,
+    LocalStorage,
+    MemoryStorage,
+    S3Storage,
+    Storage,
+    TempStorage,
+)
+
+if TYPE_CHECKING:
+    from joj.elephant.archive import Archive
+    from joj.elephant.shard import ShardedSyncReport
+    from joj.elephant.watch import WatchBatch
 
 
 def fs_parse_gitignore_fd(
     ignore_file: IO[Any], base_dir: Optional[str] = None
 ) -> Callable[[str], bool]:
+    from gitignore_parser import handle_negation, rule_from_pattern
+
     full_path = "/.gitignore"
     if base_dir is None:
         base_dir = dirname(full_path)
@@ -45,7 +59,9 @@ def fs_parse_gitignore_fd(
 
 def get_archive(
     filename: str, archive_type: ArchiveType
-) -> Tuple[Archive, ArchiveType]:
+) -> Tuple["Archive", ArchiveType]:
+    from joj.elephant.archive import Archive, TgzArchive, ZipArchive
+
     if filename and archive_type == ArchiveType.unknown:
         if filename.endswith(".zip"):
             archive_type = ArchiveType.zip
@@ -66,10 +82,22 @@ def get_archive(
 
 
 class Manager:
-    def __init__(self, rclone: RClone, source: Storage, dest: Optional[Storage] = None):
+    def __init__(
+        self,
+        rclone: RClone,
+        source: Storage,
+        dest: Optional[Storage] = None,
+        sync_retries: int = 0,
+        verify_sync: bool = False,
+        lakefs_sync: bool = False,
+    ):
         self.rclone = rclone
         self.source: Storage = source
         self.dest: Optional[Storage] = dest
+        self.sync_retries = sync_retries
+        self.verify_sync = verify_sync
+        # sync branches of one lakeFS repo with LakeFSStorage.sync_from
+        self.lakefs_sync = lakefs_sync
         self.ignore: Optional[Callable[[str], bool]] = None
         self.config: Optional[Config] = None
 
@@ -169,6 +197,7 @@ class Manager:
     #     with self.source.fs.open(filename, mode="wb") as f:
     #         f.write(config_bytes)
 
+    @instrument("validate_source")
     def validate_source(self) -> None:
         """Validate config.json on source path and generate self.config."""
         if isinstance(self.source, (LocalStorage, TempStorage, S3Storage)):
@@ -181,6 +210,7 @@ class Manager:
         else:
             raise FileSystemError("validation failed, source type not supported!")
 
+    @instrument("sync_with_validation")
     def sync_with_validation(self) -> None:
         """Sync source to dest after validation"""
         if self.dest is None:
@@ -192,12 +222,79 @@ class Manager:
         except FSError as e:
             raise FileSystemError(str(e))
 
+    @instrument("sync_without_validation")
     def sync_without_validation(self) -> None:
         """Sync source to dest directly, can be use as clone."""
         if self.dest is None:
             raise FileSystemSyncError("sync failed, destination not defined!")
+        if isinstance(self.source, MemoryStorage) and self.source.in_memory:
+            # rclone can not read from memory, and submissions are small
+            self.source.sync_all_to(self.dest)
+            return
+        if (
+            self.lakefs_sync
+            and isinstance(self.source, LakeFSStorage)
+            and isinstance(self.dest, LakeFSStorage)
+            and self.dest.lakefs_client is not None
+            and self.source.repo_name == self.dest.repo_name
+        ):
+            # branches of the same repo, copy only what the lakeFS diff reports
+            # (the last commit of source, staged on dest)
+            self.dest.sync_from(self.source)
+            return
         try:
             # options = ["--stats-one-line", "--stats", "1s", "-v"]
-            self.rclone.sync(self.source.path, self.dest.path, ["-v"])
+            # a retry skips the files already confirmed at dest by rclone
+            for attempt in range(self.sync_retries + 1):
+                response = self.rclone.sync(self.source.path, self.dest.path, ["-v"])
+                if response["code"] == 0:
+                    break
+                logger.warning(
+                    "sync attempt {} failed, error: {}", attempt + 1, response["error"]
+                )
+            else:
+                raise FileSystemSyncError(f"sync failed, error: {response['error']}!")
+            if self.verify_sync:
+                response = self.rclone.check(
+                    self.source.path, self.dest.path, ["--one-way"]
+                )
+                if response["code"] != 0:
+                    raise FileSystemSyncError(
+                        f"sync check failed, error: {response['error']}!"
+                    )
         except FSError as e:
             raise FileSystemError(str(e))
+
+    @instrument("sync_sharded")
+    def sync_sharded(
+        self,
+        shards: int = 8,
+        strategy: str = "hash",
+        jobs: Optional[int] = None,
+    ) -> "ShardedSyncReport":
+        """
+        Sync source to dest directly in shards of files (by "hash" or
+        "prefix") run in parallel, see joj.elephant.shard for details.
+        """
+        from joj.elephant.shard import ShardedSync, ShardStrategy
+
+        return ShardedSync(
+            self, shards=shards, strategy=ShardStrategy(strategy), jobs=jobs
+        ).run()
+
+    def watch(
+        self,
+        stop: Optional[Event] = None,
+        debounce: float = 0.1,
+        delta: bool = False,
+        initial_sync: bool = True,
+        on_batch: Optional[Callable[["WatchBatch"], None]] = None,
+    ) -> None:
+        """
+        Sync a local source to dest on every change until stop is set,
+        see joj.elephant.watch for details (linux only).
+        """
+        from joj.elephant.watch import Watcher
+
+        watcher = Watcher(self, debounce=debounce, delta=delta, on_batch=on_batch)
+        watcher.run(stop, initial_sync=initial_sync)
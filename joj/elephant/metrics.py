@@ -0,0 +1,265 @@
+"""
+Instrumentation of Storage, Manager and RClone operations.
+
+Nothing is measured until a hook is added with add_hook, so the cost of an
+instrumented call without hooks is a single list check.
+"""
+import random
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Measurement:
+    __slots__ = (
+        "backend",
+        "operation",
+        "start_time",
+        "duration",
+        "bytes",
+        "error",
+        "attributes",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "_start",
+    )
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+
+    def __init__(
+        self, backend: str, operation: str, parent: Optional["Measurement"]
+    ) -> None:
+        self.backend = backend
+        self.operation = operation
+        self.start_time = time.time()
+        self.duration = 0.0
+        self.bytes = 0
+        self.error: Optional[str] = None
+        self.attributes: Dict[str, str] = {}
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.parent_id = parent.span_id if parent else None
+        self._start = time.perf_counter()
+
+
+class Hook(ABC):
+    @abstractmethod
+    def record(self, measurement: Measurement) -> None:
+        raise NotImplementedError()
+
+
+_hooks: List[Hook] = []
+_current: ContextVar[Optional[Measurement]] = ContextVar(
+    "elephant_measurement", default=None
+)
+
+
+def add_hook(hook: Hook) -> None:
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def is_enabled() -> bool:
+    return bool(_hooks)
+
+
+@contextmanager
+def measure(backend: str, operation: str) -> Iterator[Optional[Measurement]]:
+    """Measure the block, yield None if instrumentation is disabled."""
+    if not _hooks:
+        yield None
+        return
+    measurement = Measurement(backend, operation, _current.get())
+    token = _current.set(measurement)
+    try:
+        yield measurement
+    except BaseException as e:
+        if measurement.error is None:
+            measurement.error = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        measurement.duration = time.perf_counter() - measurement._start
+        for hook in tuple(_hooks):
+            hook.record(measurement)
+
+
+def instrument(operation: str) -> Callable[[F], F]:
+    """Measure a method, tagged with the class name of self as backend."""
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            if not _hooks:
+                return func(self, *args, **kwargs)
+            with measure(type(self).__name__, operation):
+                return func(self, *args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def record_bytes(size: int) -> None:
+    """Add transferred bytes to the current measurement (if any)."""
+    measurement = _current.get()
+    if measurement is not None:
+        measurement.bytes += size
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+class PrometheusHook(Hook):
+    """Aggregate measurements, render them in the Prometheus text format."""
+
+    def __init__(
+        self, namespace: str = "elephant", buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.namespace = namespace
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self._bucket_counts: Dict[Tuple[str, str], List[int]] = {}
+        self._duration_sums: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._bytes: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._errors: Dict[Tuple[str, str, str], int] = defaultdict(int)
+
+    def record(self, measurement: Measurement) -> None:
+        key = (measurement.backend, measurement.operation)
+        index = bisect_left(self.buckets, measurement.duration)
+        with self._lock:
+            counts = self._bucket_counts.get(key)
+            if counts is None:
+                # the last one is +Inf
+                counts = self._bucket_counts[key] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._duration_sums[key] += measurement.duration
+            self._bytes[key] += measurement.bytes
+            if measurement.error is not None:
+                self._errors[key + (measurement.error,)] += 1
+
+    def render(self) -> str:
+        name = f"{self.namespace}_operation"
+        lines = [
+            f"# HELP {name}_duration_seconds Duration of operations.",
+            f"# TYPE {name}_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (backend, operation), counts in sorted(self._bucket_counts.items()):
+                labels = [("backend", backend), ("operation", operation)]
+                cumulative = 0
+                bounds = [str(bucket) for bucket in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, counts):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels + [("le", bound)])
+                    lines.append(
+                        f"{name}_duration_seconds_bucket{{{bucket_labels}}} {cumulative}"
+                    )
+                label_str = _format_labels(labels)
+                duration_sum = self._duration_sums[(backend, operation)]
+                lines.append(
+                    f"{name}_duration_seconds_sum{{{label_str}}} {duration_sum}"
+                )
+                lines.append(
+                    f"{name}_duration_seconds_count{{{label_str}}} {cumulative}"
+                )
+            lines += [
+                f"# HELP {name}_bytes_total Bytes transferred by operations.",
+                f"# TYPE {name}_bytes_total counter",
+            ]
+            for (backend, operation), size in sorted(self._bytes.items()):
+                label_str = _format_labels(
+                    [("backend", backend), ("operation", operation)]
+                )
+                lines.append(f"{name}_bytes_total{{{label_str}}} {size}")
+            lines += [
+                f"# HELP {name}_errors_total Failed operations.",
+                f"# TYPE {name}_errors_total counter",
+            ]
+            for (backend, operation, error), count in sorted(self._errors.items()):
+                label_str = _format_labels(
+                    [("backend", backend), ("operation", operation), ("error", error)]
+                )
+                lines.append(f"{name}_errors_total{{{label_str}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class Span(NamedTuple):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_time: float
+    end_time: float
+    attributes: Dict[str, Any]
+
+
+class TracingHook(Hook):
+    """
+    Turn measurements into trace spans, nested calls share the trace of their
+    parent. Spans are passed to exporter (if any) and the latest max_spans
+    are kept in self.spans.
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[Callable[[Span], None]] = None,
+        max_spans: int = 10000,
+    ) -> None:
+        self.exporter = exporter
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def record(self, measurement: Measurement) -> None:
+        attributes: Dict[str, Any] = {
+            "backend": measurement.backend,
+            "bytes": measurement.bytes,
+            **measurement.attributes,
+        }
+        if measurement.error is not None:
+            attributes["error"] = measurement.error
+        span = Span(
+            name=f"{measurement.backend}.{measurement.operation}",
+            trace_id=measurement.trace_id,
+            span_id=measurement.span_id,
+            parent_id=measurement.parent_id,
+            start_time=measurement.start_time,
+            end_time=measurement.start_time + measurement.duration,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        if self.exporter is not None:
+            self.exporter(span)
@@ -0,0 +1,172 @@
+"""
+Adaptive (AIMD) concurrency control of S3 requests.
+
+One controller is shared by all clients talking to the same endpoint in the
+process. A request waits for a slot before it is sent; the limit grows by
+about one slot per round of successful requests and is cut by half when the
+backend throttles (503 SlowDown, 429, ...) or answers slower than
+latency_threshold.
+"""
+import time
+from threading import Condition, Lock, local
+from typing import Any, Dict, NamedTuple, Optional
+
+THROTTLING_STATUS_CODES = {429, 503}
+THROTTLING_ERROR_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestLimitExceeded",
+    "TooManyRequests",
+    "TooManyRequestsException",
+}
+
+_UNIQUE_ID = "elephant_rate_control"
+
+
+class RateControlStats(NamedTuple):
+    limit: int
+    in_flight: int
+    requests: int
+    throttled: int
+    slow: int
+
+
+class AdaptiveConcurrencyController:
+    def __init__(
+        self,
+        initial_limit: int = 32,
+        min_limit: int = 1,
+        max_limit: int = 512,
+        decrease_factor: float = 0.5,
+        latency_threshold: Optional[float] = None,
+    ) -> None:
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("limits must be 1 <= min <= initial <= max!")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._requests = 0
+        self._throttled = 0
+        self._slow = 0
+        self._last_decrease = 0.0
+        self._condition = Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def stats(self) -> RateControlStats:
+        with self._condition:
+            return RateControlStats(
+                limit=int(self._limit),
+                in_flight=self._in_flight,
+                requests=self._requests,
+                throttled=self._throttled,
+                slow=self._slow,
+            )
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency: float, throttled: bool = False) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._requests += 1
+            slow = (
+                self.latency_threshold is not None and latency > self.latency_threshold
+            )
+            if throttled or slow:
+                if throttled:
+                    self._throttled += 1
+                else:
+                    self._slow += 1
+                now = time.monotonic()
+                # responses of requests sent before the last decrease
+                # do not reflect it yet, so decrease once per round trip
+                if now - self._last_decrease > latency:
+                    self._limit = max(
+                        float(self.min_limit), self._limit * self.decrease_factor
+                    )
+                    self._last_decrease = now
+            else:
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+
+_controllers: Dict[str, AdaptiveConcurrencyController] = {}
+_controllers_lock = Lock()
+
+
+def get_rate_controller(
+    endpoint: Optional[str], **options: Any
+) -> AdaptiveConcurrencyController:
+    """Return the shared controller of endpoint, options apply on creation only."""
+    key = endpoint or "default"
+    with _controllers_lock:
+        controller = _controllers.get(key)
+        if controller is None:
+            controller = _controllers[key] = AdaptiveConcurrencyController(**options)
+        return controller
+
+
+def get_rate_control_stats() -> Dict[str, RateControlStats]:
+    with _controllers_lock:
+        controllers = dict(_controllers)
+    return {key: controller.stats for key, controller in controllers.items()}
+
+
+def is_throttled(
+    response_dict: Optional[Dict[str, Any]], parsed_response: Optional[Dict[str, Any]]
+) -> bool:
+    if response_dict is not None and (
+        response_dict.get("status_code") in THROTTLING_STATUS_CODES
+    ):
+        return True
+    if parsed_response is not None:
+        return parsed_response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return False
+
+
+def install_rate_control(
+    client: Any, controller: AdaptiveConcurrencyController
+) -> None:
+    """Make every http request (including retries) of a boto3 client
+    wait for a slot of controller."""
+
+    # an attempt is sent and received on the same thread
+    attempt = local()
+
+    def before_send(**kwargs: Any) -> None:
+        controller.acquire()
+        attempt.start = time.perf_counter()
+
+    def response_received(
+        response_dict: Optional[Dict[str, Any]] = None,
+        parsed_response: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        start = getattr(attempt, "start", None)
+        attempt.start = None
+        if start is not None:
+            controller.release(
+                time.perf_counter() - start,
+                is_throttled(response_dict, parsed_response),
+            )
+
+    events = client.meta.events
+    events.register("before-send.s3", before_send, unique_id=f"{_UNIQUE_ID}_send")
+    events.register(
+        "response-received.s3",
+        response_received,
+        unique_id=f"{_UNIQUE_ID}_received",
+    )
@@ -27,6 +27,8 @@ from typing import Any, Dict, List
 
 from loguru import logger
 
+from joj.elephant.metrics import measure
+
 
 class RClone:
     """
@@ -46,6 +48,16 @@ class RClone:
                                          as a new element in the list.
         """
         logger.debug("Invoking : {}", " ".join(command_with_args))
+        operation = command_with_args[1] if len(command_with_args) > 1 else ""
+        with measure("rclone", operation) as measurement:
+            result = self._execute_command(command_with_args)
+            if measurement is not None:
+                measurement.attributes["exit_code"] = str(result["code"])
+                if result["code"] != 0:
+                    measurement.error = f"exit_{result['code']}"
+        return result
+
+    def _execute_command(self, command_with_args: List[str]) -> Dict[str, Any]:
         try:
             with subprocess.Popen(
                 command_with_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
@@ -107,6 +119,16 @@ class RClone:
         """
         return self.run_cmd(command="sync", extra_args=[source] + [dest] + flags)
 
+    def check(self, source: str, dest: str, flags: List[str] = []) -> Dict[str, Any]:
+        """
+        Executes: rclone check source:path dest:path [flags]
+        Args:
+        - source (string): A string "source:path"
+        - dest (string): A string "dest:path"
+        - flags (list): Extra flags as per `rclone check --help` flags.
+        """
+        return self.run_cmd(command="check", extra_args=[source] + [dest] + flags)
+
     def listremotes(self, flags: List[str] = []) -> Dict[str, Any]:
         """
         Executes: rclone listremotes [flags]
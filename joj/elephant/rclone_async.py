@@ -109,6 +109,16 @@ class AsyncRClone:
         """
         return await self.run_cmd(command="sync", extra_args=[source] + [dest] + flags)
 
+    async def check(self, source, dest, flags=[]):
+        """
+        Executes: rclone check source:path dest:path [flags]
+        Args:
+        - source (string): A string "source:path"
+        - dest (string): A string "dest:path"
+        - flags (list): Extra flags as per `rclone check --help` flags.
+        """
+        return await self.run_cmd(command="check", extra_args=[source] + [dest] + flags)
+
     async def listremotes(self, flags=[]):
         """
         Executes: rclone listremotes [flags]
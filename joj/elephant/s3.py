@@ -0,0 +1,69 @@
+import threading
+import weakref
+from typing import Any, Optional, Tuple
+
+from fs_s3fs import S3FS
+
+from joj.elephant.rate_control import (
+    AdaptiveConcurrencyController,
+    install_rate_control,
+)
+
+# boto3 clients (thread-safe) shared by all S3FS with the same connection
+# settings, so that a process handling many storages reuses their connection
+# pools; held weakly, a client goes away with the last S3FS using it
+_clients: "weakref.WeakValueDictionary[Tuple[Any, ...], Any]" = (
+    weakref.WeakValueDictionary()
+)
+_clients_lock = threading.Lock()
+
+
+class RateControlledS3FS(S3FS):
+    """
+    S3FS whose boto3 clients share a rate controller and are pooled in the
+    process by connection settings; resources stay per thread.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        rate_controller: Optional[AdaptiveConcurrencyController] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.rate_controller = rate_controller
+
+    @property
+    def s3(self) -> Any:
+        # resources are not thread-safe, one per thread as in S3FS
+        if not hasattr(self._tlocal, "s3"):
+            resource = S3FS.s3.fget(self)
+            if self.rate_controller is not None:
+                install_rate_control(resource.meta.client, self.rate_controller)
+            self._tlocal.s3 = resource
+        return self._tlocal.s3
+
+    @property
+    def client(self) -> Any:
+        if not hasattr(self._tlocal, "client"):
+            self._tlocal.client = self._get_client()
+        return self._tlocal.client
+
+    def _get_client(self) -> Any:
+        key = (
+            self.region,
+            self.aws_access_key_id,
+            self.aws_secret_access_key,
+            self.aws_session_token,
+            self.endpoint_url,
+            id(self.rate_controller),
+        )
+        with _clients_lock:
+            client = _clients.get(key)
+        if client is None:
+            client = S3FS.client.fget(self)
+            if self.rate_controller is not None:
+                install_rate_control(client, self.rate_controller)
+            with _clients_lock:
+                client = _clients.setdefault(key, client)
+        return client
@@ -27,6 +27,47 @@ class FileInfo(BaseModel):
     checksum: Optional[str] = None
     mtime: Optional[Union[datetime, str]] = None
     size_bytes: Optional[int] = None
+    metadata: Dict[str, str] = {}
+
+
+class PartCheckpoint(BaseModel):
+    part_number: int
+    etag: str
+    size_bytes: int
+
+
+class TransferCheckpoint(BaseModel):
+    source: str
+    size_bytes: int
+    mtime_ns: int
+    offset: int = 0
+    upload_id: Optional[str] = None
+    # size of the parts of upload_id
+    chunk_size: Optional[int] = None
+    parts: List[PartCheckpoint] = []
+
+
+class BlockSignatures(BaseModel):
+    block_size: int
+    size_bytes: int
+    weak: List[int] = []
+    strong: List[str] = []
+    # identify the remote object the signatures were computed for
+    checksum: Optional[str] = None
+    mtime: Optional[str] = None
+
+
+class DiffType(StrEnumMixin, Enum):
+    added = "added"
+    removed = "removed"
+    changed = "changed"
+    conflict = "conflict"
+
+
+class DiffEntry(BaseModel):
+    type: DiffType
+    path: str
+    size_bytes: Optional[int] = None
 
 
 def snake2camel(snake: str, start_lower: bool = False) -> str:
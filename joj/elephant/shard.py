@@ -0,0 +1,197 @@
+"""
+Sync of a huge problem tree split into shards run in parallel.
+
+Both trees are listed with one worker per top-level directory, the files are
+partitioned into shards by their top-level directory (prefix) or by a hash of
+their path, and every shard is copied by its own rclone process restricted
+to its files with --files-from. Files missing at the source are deleted from
+the destination only after every shard has been copied, so a failed shard
+never leaves the destination with fewer files than before.
+"""
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set
+
+from fs.errors import FSError
+from loguru import logger
+from pydantic import BaseModel
+
+from joj.elephant.errors import FileSystemError, FileSystemSyncError
+from joj.elephant.schemas import StrEnumMixin
+from joj.elephant.storage import Storage
+
+if TYPE_CHECKING:
+    from joj.elephant.manager import Manager
+
+DEFAULT_SHARDS = 8
+
+
+class ShardStrategy(StrEnumMixin, Enum):
+    prefix = "prefix"
+    hash = "hash"
+
+
+class ShardResult(BaseModel):
+    index: int
+    files: int
+    attempts: int
+    seconds: float
+    error: Optional[str] = None
+
+
+class ShardedSyncReport(BaseModel):
+    strategy: ShardStrategy
+    shards: List[ShardResult] = []
+    # source files synced by the shards, rclone skips the unchanged ones
+    files: int = 0
+    deleted: int = 0
+    list_seconds: float = 0.0
+    seconds: float = 0.0
+
+
+def list_files(storage: Storage, jobs: int) -> Set[str]:
+    """
+    List the files of storage, each top-level directory in parallel with
+    list_compact (paged list_objects_v2 on S3, not a request per directory).
+    """
+    fs = storage.fs
+    try:
+        if not fs.exists("/"):
+            return set()
+        files, dirs = set(), []
+        for info in fs.scandir("/"):
+            if info.is_dir:
+                dirs.append(info.name)
+            else:
+                files.add(info.name)
+    except FSError as e:
+        raise FileSystemError(str(e))
+
+    def walk(name: str) -> List[str]:
+        batch = storage.list_compact(Path(f"/{name}"))
+        return [
+            f"{name}/{batch.path(index)}"
+            for index in range(len(batch))
+            if not batch.is_dir[index]
+        ]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for paths in executor.map(walk, dirs):
+            files.update(paths)
+    return files
+
+
+def partition(
+    files: Iterable[str], shards: int, strategy: ShardStrategy
+) -> List[List[str]]:
+    """
+    Split files into at most shards non-empty lists. By prefix, the files of
+    a top-level directory stay together and the directories are balanced by
+    file count over the shards.
+    """
+    result: List[List[str]] = [[] for _ in range(shards)]
+    if strategy == ShardStrategy.hash:
+        for path in files:
+            result[zlib.crc32(path.encode("utf-8")) % shards].append(path)
+    else:
+        groups: Dict[str, List[str]] = {}
+        for path in files:
+            groups.setdefault(path.split("/", 1)[0], []).append(path)
+        for group in sorted(groups.values(), key=len, reverse=True):
+            min(result, key=len).extend(group)
+    return [sorted(shard) for shard in result if shard]
+
+
+class ShardedSync:
+    """Sync the source of manager to its destination in shards."""
+
+    def __init__(
+        self,
+        manager: "Manager",
+        shards: int = DEFAULT_SHARDS,
+        strategy: ShardStrategy = ShardStrategy.hash,
+        jobs: Optional[int] = None,
+    ) -> None:
+        if manager.dest is None:
+            raise FileSystemSyncError("sync failed, destination not defined!")
+        self.manager = manager
+        self.source = manager.source
+        self.dest: Storage = manager.dest
+        self.shards = max(shards, 1)
+        self.strategy = strategy
+        self.jobs = jobs or min(self.shards, os.cpu_count() or 1)
+
+    def _write_list(self, work_dir: str, name: str, files: List[str]) -> str:
+        file_path = os.path.join(work_dir, name)
+        with open(file_path, "w") as f:
+            f.writelines(f"{path}\n" for path in files)
+        return file_path
+
+    def _copy_shard(self, work_dir: str, index: int, files: List[str]) -> ShardResult:
+        start = time.perf_counter()
+        flags = ["--files-from", self._write_list(work_dir, f"shard-{index}", files)]
+        rclone = self.manager.rclone
+        error: Optional[str] = None
+        attempts = 0
+        for attempts in range(1, self.manager.sync_retries + 2):
+            response = rclone.copy(self.source.path, self.dest.path, ["-v"] + flags)
+            if response["code"] == 0:
+                error = None
+                break
+            error = f"copy failed, error: {response['error']}"
+            logger.warning("shard {} attempt {} {}", index, attempts, error)
+        if error is None and self.manager.verify_sync:
+            response = rclone.check(
+                self.source.path, self.dest.path, ["--one-way"] + flags
+            )
+            if response["code"] != 0:
+                error = f"check failed, error: {response['error']}"
+        return ShardResult(
+            index=index,
+            files=len(files),
+            attempts=attempts,
+            seconds=time.perf_counter() - start,
+            error=error,
+        )
+
+    def run(self) -> ShardedSyncReport:
+        start = time.perf_counter()
+        report = ShardedSyncReport(strategy=self.strategy)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            source_future = executor.submit(list_files, self.source, self.jobs)
+            dest_future = executor.submit(list_files, self.dest, self.jobs)
+            source_files, dest_files = source_future.result(), dest_future.result()
+        report.list_seconds = time.perf_counter() - start
+
+        shards = partition(source_files, self.shards, self.strategy)
+        with TemporaryDirectory(prefix="elephant-shards-") as work_dir:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [
+                    executor.submit(self._copy_shard, work_dir, index, files)
+                    for index, files in enumerate(shards)
+                ]
+                report.shards = [future.result() for future in futures]
+            failed = [shard for shard in report.shards if shard.error is not None]
+            if failed:
+                raise FileSystemSyncError(
+                    f"sync failed in {len(failed)} of {len(shards)} shards, "
+                    f"error: {failed[0].error}!"
+                )
+            report.files = len(source_files)
+
+            deleted = sorted(dest_files - source_files)
+            if deleted:
+                flags = ["--files-from", self._write_list(work_dir, "deleted", deleted)]
+                response = self.manager.rclone.delete(self.dest.path, flags)
+                if response["code"] != 0:
+                    raise FileSystemSyncError(
+                        f"sync failed, delete error: {response['error']}!"
+                    )
+            report.deleted = len(deleted)
+        report.seconds = time.perf_counter() - start
+        return report
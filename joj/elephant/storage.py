@@ -1,17 +1,114 @@
+import mmap
+import os
+import threading
 from abc import ABC
+from contextlib import contextmanager
+from hashlib import md5
+from io import BytesIO
 from pathlib import Path
-from typing import IO, Any, BinaryIO, List, Optional, SupportsInt
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    SupportsInt,
+    Tuple,
+    cast,
+)
 
-import patoolib
 from fs.base import FS
 from fs.errors import FSError
 from fs.info import Info
 from fs.osfs import OSFS
-from fs.tempfs import TempFS
-from fs_s3fs import S3FS
+from loguru import logger
 
-from joj.elephant.errors import ArchiveError, FileSystemError
-from joj.elephant.schemas import FileInfo
+from joj.elephant.checkpoint import CheckpointStore
+from joj.elephant.delta import (
+    DELTA_BLOCK_SIZE,
+    DeltaOp,
+    SignatureStore,
+    compute_delta,
+    compute_signatures,
+    group_parts,
+)
+from joj.elephant.errors import (
+    ArchiveError,
+    FileSystemError,
+    FileSystemSyncError,
+    FileSystemUndefinedError,
+)
+from joj.elephant.listing import FileInfoBatch, to_mtime_ns
+from joj.elephant.metrics import instrument, is_enabled, record_bytes
+from joj.elephant.rate_control import get_rate_controller
+from joj.elephant.schemas import (
+    BlockSignatures,
+    DiffEntry,
+    DiffType,
+    FileInfo,
+    PartCheckpoint,
+    TransferCheckpoint,
+)
+
+# backend dependencies (boto3, patool, ...) are imported on first use
+if TYPE_CHECKING:
+    from fs_s3fs import S3FS
+    from lakefs_client.client import LakeFSClient
+
+COPY_CHUNK_SIZE = 1024 * 1024 * 8
+SPILL_THRESHOLD = 1024 * 1024 * 4
+RESUMABLE_CHUNK_SIZE = 1024 * 1024 * 64
+S3_MIN_PART_SIZE = 1024 * 1024 * 5
+S3_MAX_PART_SIZE = 1024 * 1024 * 1024 * 5
+# errors of complete_multipart_upload that a retry of the same parts repeats
+S3_FATAL_COMPLETE_ERRORS = ("EntityTooSmall", "InvalidPart", "InvalidPartOrder")
+
+
+def copy_fd(src_fd: int, dest_fd: int, count: int) -> int:
+    """Copy count bytes between two file descriptors inside the kernel."""
+    copied = 0
+    use_copy_file_range = hasattr(os, "copy_file_range")
+    while copied < count:
+        size = min(COPY_CHUNK_SIZE, count - copied)
+        if use_copy_file_range:
+            try:
+                sent = os.copy_file_range(src_fd, dest_fd, size)
+            except OSError:
+                # e.g. EXDEV on old kernels or unsupported file systems
+                use_copy_file_range = False
+                continue
+        else:
+            sent = os.sendfile(dest_fd, src_fd, None, size)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def md5_file(file: IO[bytes], chunk_size: int = COPY_CHUNK_SIZE) -> str:
+    hash_md5 = md5()
+    for chunk in iter(lambda: file.read(chunk_size), b""):
+        hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+@contextmanager
+def mmap_file(file: IO[bytes]) -> Iterator[memoryview]:
+    """Yield a read-only view of a whole local file."""
+    if os.fstat(file.fileno()).st_size == 0:
+        # mmap refuses to map empty files
+        yield memoryview(b"")
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            yield view
+        finally:
+            view.release()
 
 
 class Storage(ABC):
@@ -33,29 +130,333 @@ class Storage(ABC):
             size_bytes=info.size,
         )
 
+    @instrument("getinfo")
     def getinfo(self, path: Path) -> FileInfo:
-        info = self.fs.getinfo(path=str(path), namespaces=["details"])
+        try:
+            info = self.fs.getinfo(path=str(path), namespaces=["details"])
+        except FSError as e:
+            raise FileSystemError(str(e))
         return self.parse_file_info(path, info)
 
+    @instrument("list_compact")
+    def list_compact(self, path: Path = Path("/")) -> FileInfoBatch:
+        """
+        List the tree under path (paths relative to it) without building a
+        FileInfo per entry, for listing and diffing huge trees.
+        """
+        batch = FileInfoBatch()
+        root = str(path).rstrip("/")
+        prefix_length = len(root) + 1
+        try:
+            for entry_path, info in self.fs.walk.info(
+                path=root or "/", namespaces=["details"]
+            ):
+                details = cast(Dict[str, Any], info.raw.get("details", {}))
+                modified = details.get("modified")
+                batch.append(
+                    entry_path[prefix_length:],
+                    is_dir=info.is_dir,
+                    size_bytes=None if info.is_dir else details.get("size"),
+                    mtime_ns=None if modified is None else int(modified * 1e9),
+                )
+        except FSError as e:
+            raise FileSystemError(str(e))
+        return batch
+
+    @instrument("upload")
     def upload(
-        self, path: Path, file: BinaryIO, chunk_size: Optional[int] = None
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        """Upload file to path, metadata is kept only by backends supporting it."""
+        return self._upload(path, file, chunk_size, metadata)
+
+    def _upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
     ) -> FileInfo:
         try:
             self.fs.makedirs(path=str(path.parent), recreate=True)
             self.fs.upload(path=str(path), file=file, chunk_size=chunk_size)
-            return self.getinfo(path)
+            file_info = self.getinfo(path)
+            record_bytes(file_info.size_bytes or 0)
+            return file_info
         except FSError as e:
             raise FileSystemError(str(e))
 
+    @instrument("download")
     def download(
         self, path: Path, file: BinaryIO, chunk_size: Optional[int] = None
     ) -> None:
+        position = file.tell() if is_enabled() and file.seekable() else None
         try:
             self.fs.download(path=str(path), file=file, chunk_size=chunk_size)
             # return self.fs.getinfo(path=str(path))
         except FSError as e:
             raise FileSystemError(str(e))
+        if position is not None:
+            record_bytes(file.tell() - position)
+
+    @instrument("upload_resumable")
+    def upload_resumable(
+        self,
+        path: Path,
+        source: str,
+        checkpoints: Optional[CheckpointStore] = None,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+    ) -> FileInfo:
+        """
+        Upload the local file source, continuing from the checkpoint of an
+        interrupted try. Data is written to "<path>.partial", compared with
+        source and moved to path at the end.
+        """
+        checkpoints = checkpoints or CheckpointStore()
+        key = f"{self.path}|{path}"
+        checkpoint = checkpoints.load(key, source)
+        partial_path = str(path.parent / f"{path.name}.partial")
+        try:
+            self.fs.makedirs(path=str(path.parent), recreate=True)
+            if (
+                checkpoint is not None
+                and self.fs.exists(partial_path)
+                and self.fs.getsize(partial_path) >= checkpoint.offset
+            ):
+                logger.info("resume {} from byte {}", path, checkpoint.offset)
+                dest = self.fs.openbin(partial_path, mode="r+")
+                dest.seek(checkpoint.offset)
+                dest.truncate()
+            else:
+                checkpoint = checkpoints.get_source_checkpoint(source)
+                dest = self.fs.openbin(partial_path, mode="w")
+            with dest, open(source, "rb") as src:
+                src.seek(checkpoint.offset)
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    dest.write(chunk)
+                    dest.flush()
+                    record_bytes(len(chunk))
+                    checkpoint.offset += len(chunk)
+                    checkpoints.save(key, checkpoint)
+            with self.fs.openbin(partial_path) as dest, open(source, "rb") as src:
+                if md5_file(dest) != md5_file(src):
+                    self.fs.remove(partial_path)
+                    checkpoints.remove(key)
+                    raise FileSystemSyncError(f"integrity check of {path} failed!")
+            self.fs.move(partial_path, str(path), overwrite=True)
+        except (FSError, OSError) as e:
+            raise FileSystemError(str(e))
+        checkpoints.remove(key)
+        return self.getinfo(path)
+
+    def _load_signatures(
+        self, path: Path, signatures: SignatureStore, key: str
+    ) -> Optional[BlockSignatures]:
+        """Load the signatures of path, None if the object has changed since."""
+        old = signatures.load(key)
+        if old is None:
+            return None
+        try:
+            file_info = self.getinfo(path)
+        except FileSystemError:
+            return None
+        if (
+            file_info.size_bytes != old.size_bytes
+            or file_info.checksum != old.checksum
+            or (str(file_info.mtime) if file_info.mtime else None) != old.mtime
+        ):
+            logger.info("{} changed since the last upload, no delta", path)
+            return None
+        return old
+
+    def _apply_delta(
+        self, path: Path, data: memoryview, ops: List[DeltaOp], old: BlockSignatures
+    ) -> Optional[FileInfo]:
+        """
+        Rebuild path from its old version (described by old) and the literal
+        data of ops, return None if the backend can not do it (the whole file
+        is uploaded then).
+        """
+        syspath = self.getsyspath(path)
+        if syspath is None:
+            return None
+        partial_path = f"{syspath}.partial"
+        try:
+            # unbuffered, so that writes and kernel copies share the offsets
+            with open(syspath, "rb", buffering=0) as src, open(
+                partial_path, "wb", buffering=0
+            ) as dest:
+                for op in ops:
+                    if op.source_offset is None:
+                        dest.write(data[op.offset : op.offset + op.length])
+                        record_bytes(op.length)
+                    else:
+                        src.seek(op.source_offset)
+                        copy_fd(src.fileno(), dest.fileno(), op.length)
+                if dest.tell() != len(data):
+                    raise FileSystemSyncError(f"integrity check of {path} failed!")
+            os.replace(partial_path, syspath)
+        except OSError as e:
+            raise FileSystemError(str(e))
+        return self.getinfo(path)
+
+    @instrument("upload_delta")
+    def upload_delta(
+        self,
+        path: Path,
+        source: str,
+        signatures: Optional[SignatureStore] = None,
+        block_size: int = DELTA_BLOCK_SIZE,
+    ) -> FileInfo:
+        """
+        Upload the local file source, sending only the blocks that are not in
+        the version of path uploaded last time (found by its signatures).
+        """
+        signatures = signatures or SignatureStore()
+        key = f"{self.path}|{path}"
+        old = self._load_signatures(path, signatures, key)
+        try:
+            f = open(source, "rb")
+        except OSError as e:
+            raise FileSystemError(str(e))
+        with f, mmap_file(f) as data:
+            file_info = None
+            if old is not None:
+                ops = compute_delta(data, old)
+                literal = sum(op.length for op in ops if op.source_offset is None)
+                logger.info(
+                    "delta upload of {}: {} of {} bytes changed",
+                    path,
+                    literal,
+                    len(data),
+                )
+                file_info = self._apply_delta(path, data, ops, old)
+            if file_info is None:
+                file_info = self.upload(path, f)
+            new = compute_signatures(data, block_size)
+        new.checksum = file_info.checksum
+        new.mtime = str(file_info.mtime) if file_info.mtime else None
+        signatures.save(key, new)
+        return file_info
+
+    def getsyspath(self, path: Path) -> Optional[str]:
+        """Return the os path of a file, or None if it is not on a local disk."""
+        if self.fs.hassyspath(str(path)):
+            return self.fs.getsyspath(str(path))
+        return None
 
+    @instrument("read_range")
+    def read_range(
+        self, path: Path, offset: int, length: Optional[int] = None
+    ) -> bytes:
+        """Read length bytes (or until EOF if None) starting at offset."""
+        if length == 0:
+            return b""
+        try:
+            with self.fs.openbin(str(path), mode="r") as f:
+                f.seek(offset)
+                data = f.read(-1 if length is None else length)
+        except FSError as e:
+            raise FileSystemError(str(e))
+        record_bytes(len(data))
+        return data
+
+    @contextmanager
+    def open_mmap(self, path: Path) -> Iterator[memoryview]:
+        """Yield a read-only view of the whole file.
+
+        Local files are memory-mapped, other backends fall back to a buffer.
+        The view (and any slice of it) is only valid inside the with block.
+        """
+        syspath = self.getsyspath(path)
+        if syspath is not None:
+            try:
+                f = open(syspath, "rb")
+            except OSError as e:
+                raise FileSystemError(str(e))
+            with f, mmap_file(f) as view:
+                yield view
+            return
+        file = BytesIO()
+        self.download(path, file)
+        view = file.getbuffer()
+        try:
+            yield view.toreadonly()
+        finally:
+            view.release()
+
+    @instrument("copy_to")
+    def copy_to(
+        self,
+        path: Path,
+        dest: "Storage",
+        dest_path: Optional[Path] = None,
+        delta: bool = False,
+    ) -> FileInfo:
+        """
+        Copy a file to another storage, in kernel space if both are local.
+        With delta, a local file is sent to a remote dest by upload_delta.
+        """
+        if dest_path is None:
+            dest_path = path
+        src_syspath = self.getsyspath(path)
+        dest_syspath = dest.getsyspath(dest_path)
+        if delta and src_syspath is not None and dest_syspath is None:
+            return dest.upload_delta(dest_path, src_syspath)
+        if src_syspath is None or dest_syspath is None:
+            try:
+                with self.fs.openbin(str(path), mode="r") as f:
+                    return dest.upload(dest_path, f)
+            except FSError as e:
+                raise FileSystemError(str(e))
+        try:
+            os.makedirs(os.path.dirname(dest_syspath), exist_ok=True)
+            with open(src_syspath, "rb") as src, open(dest_syspath, "wb") as dst:
+                size = copy_fd(
+                    src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size
+                )
+                record_bytes(size)
+        except OSError as e:
+            raise FileSystemError(str(e))
+        return dest.getinfo(dest_path)
+
+    def copy_all_to(
+        self, dest: "Storage", dest_dir: Path = Path("/")
+    ) -> List[FileInfo]:
+        """Copy every file to dest_dir of another storage without rclone."""
+        try:
+            file_paths = list(self.fs.walk.files())
+        except FSError as e:
+            raise FileSystemError(str(e))
+        return [
+            self.copy_to(Path(file_path), dest, dest_dir / file_path.lstrip("/"))
+            for file_path in file_paths
+        ]
+
+    def sync_all_to(self, dest: "Storage") -> List[FileInfo]:
+        """
+        Make dest match this storage without rclone: copy every file, then
+        delete the files of dest missing here (like rclone sync).
+        """
+        file_infos = self.copy_all_to(dest)
+        copied = {file_info.path.lstrip("/") for file_info in file_infos}
+        try:
+            dest_paths = [
+                file_path
+                for file_path in dest.fs.walk.files()
+                if file_path.lstrip("/") not in copied
+            ]
+        except FSError as e:
+            raise FileSystemError(str(e))
+        for file_path in dest_paths:
+            dest.delete(Path(file_path.lstrip("/")))
+        return file_infos
+
+    @instrument("delete")
     def delete(self, path: Path) -> FileInfo:
         try:
             file_info = self.getinfo(path)
@@ -64,6 +465,7 @@ class Storage(ABC):
         except FSError as e:
             raise FileSystemError(str(e))
 
+    @instrument("delete_dir")
     def delete_dir(self, path: Path) -> FileInfo:
         try:
             file_info = self.getinfo(path)
@@ -72,6 +474,7 @@ class Storage(ABC):
         except FSError as e:
             raise FileSystemError(str(e))
 
+    @instrument("delete_tree")
     def delete_tree(self, path: Path) -> FileInfo:
         try:
             file_info = self.getinfo(path)
@@ -96,16 +499,29 @@ class S3Storage(Storage):
         username: Optional[str] = None,
         password: Optional[str] = None,
         endpoint_url: Optional[str] = None,
+        rate_control: bool = True,
     ) -> None:
+        from joj.elephant.s3 import RateControlledS3FS
+
         super().__init__(path=f"{host_in_config}:{bucket_name}{dir_path}")
-        self._fs = S3FS(
+        # requests to one endpoint share an adaptive concurrency limit
+        self.rate_controller = (
+            get_rate_controller(endpoint_url) if rate_control else None
+        )
+        self._fs = RateControlledS3FS(
             bucket_name=bucket_name,
             dir_path=dir_path,
             aws_access_key_id=username,
             aws_secret_access_key=password,
             endpoint_url=endpoint_url,
+            rate_controller=self.rate_controller,
         )
 
+    @property
+    def fs(self) -> "S3FS":
+        return self._fs
+
+    @instrument("getinfo")
     def getinfo(self, path: Path) -> FileInfo:
         try:
             info = self.fs.getinfo(path=str(path), namespaces=["details", "s3"])
@@ -114,10 +530,380 @@ class S3Storage(Storage):
             if checksum:
                 checksum = checksum.strip('"')
             file_info.checksum = checksum
+            file_info.metadata = info.raw.get("s3", {}).get("metadata") or {}
             return file_info
         except FSError as e:
             raise FileSystemError(str(e))
 
+    @instrument("list_compact")
+    def list_compact(self, path: Path = Path("/")) -> FileInfoBatch:
+        """
+        Page list_objects_v2 under path, which returns the size, mtime and
+        etag of up to 1000 objects per request (walking S3FS heads each one).
+        Directories are the prefixes of the keys.
+        """
+        from botocore.exceptions import ClientError
+
+        batch = FileInfoBatch()
+        prefix = self.fs._path_to_dir_key(str(path))
+        delimiter = self.fs.delimiter
+        dirs = {""}
+        try:
+            paginator = self.fs.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.fs._bucket_name, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    entry_path = obj["Key"][len(prefix) :].replace(delimiter, "/")
+                    if not entry_path:
+                        # the marker of path itself
+                        continue
+                    is_dir = entry_path.endswith("/")
+                    entry_path = entry_path.rstrip("/")
+                    parent = entry_path if is_dir else entry_path.rpartition("/")[0]
+                    # the parents of a key, once each
+                    missing = []
+                    while parent not in dirs:
+                        dirs.add(parent)
+                        missing.append(parent)
+                        parent = parent.rpartition("/")[0]
+                    for dir_path in reversed(missing):
+                        batch.append(dir_path, is_dir=True)
+                    if is_dir:
+                        continue
+                    batch.append(
+                        entry_path,
+                        size_bytes=obj["Size"],
+                        mtime_ns=to_mtime_ns(obj["LastModified"]),
+                        checksum=obj["ETag"].strip('"'),
+                    )
+            if not batch and not self.fs.isdir(str(path)):
+                raise FileSystemError(f"directory {path} not found!")
+        except (ClientError, FSError) as e:
+            raise FileSystemError(str(e))
+        return batch
+
+    def _upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        """Metadata is stored as S3 user metadata."""
+        if not metadata:
+            return super()._upload(path, file, chunk_size)
+        from botocore.exceptions import ClientError
+
+        key = self.fs._path_to_key(str(path))
+        try:
+            self.fs.client.upload_fileobj(
+                file,
+                self.fs._bucket_name,
+                key,
+                ExtraArgs={**self.fs._get_upload_args(key), "Metadata": metadata},
+            )
+        except ClientError as e:
+            raise FileSystemError(str(e))
+        file_info = self.getinfo(path)
+        record_bytes(file_info.size_bytes or 0)
+        return file_info
+
+    @instrument("read_range")
+    def read_range(
+        self, path: Path, offset: int, length: Optional[int] = None
+    ) -> bytes:
+        from botocore.exceptions import ClientError
+
+        if length == 0:
+            return b""
+        end = "" if length is None else str(offset + length - 1)
+        try:
+            response = self.fs.client.get_object(
+                Bucket=self.fs._bucket_name,
+                Key=self.fs._path_to_key(str(path)),
+                Range=f"bytes={offset}-{end}",
+            )
+            data = response["Body"].read()
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                # offset beyond the end of object, same as reading past EOF
+                return b""
+            raise FileSystemError(str(e))
+        record_bytes(len(data))
+        return data
+
+    def _list_uploaded_parts(
+        self, key: str, upload_id: str
+    ) -> Optional[Dict[int, str]]:
+        """Return {part number: etag} of a multipart upload, None if it is gone."""
+        from botocore.exceptions import ClientError
+
+        parts: Dict[int, str] = {}
+        marker = 0
+        while True:
+            try:
+                response = self.fs.client.list_parts(
+                    Bucket=self.fs._bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumberMarker=marker,
+                )
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") == "NoSuchUpload":
+                    return None
+                raise
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"].strip('"')
+            if not response.get("IsTruncated"):
+                return parts
+            marker = response["NextPartNumberMarker"]
+
+    def _abort_multipart_upload(self, key: str, upload_id: str) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.fs.client.abort_multipart_upload(
+                Bucket=self.fs._bucket_name, Key=key, UploadId=upload_id
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "NoSuchUpload":
+                raise
+
+    def _resume_multipart_upload(
+        self, key: str, checkpoint: Optional[TransferCheckpoint], chunk_size: int
+    ) -> Optional[TransferCheckpoint]:
+        """
+        Keep only the parts in checkpoint that are confirmed by S3, the upload
+        of a checkpoint with another chunk size is aborted.
+        """
+        if checkpoint is None or checkpoint.upload_id is None:
+            return None
+        if checkpoint.chunk_size != chunk_size:
+            logger.info("chunk size of {} changed, restart the upload", key)
+            self._abort_multipart_upload(key, checkpoint.upload_id)
+            return None
+        uploaded = self._list_uploaded_parts(key, checkpoint.upload_id)
+        if uploaded is None:
+            return None
+        checkpoint.parts = [
+            part
+            for part in checkpoint.parts
+            if uploaded.get(part.part_number) == part.etag
+        ]
+        return checkpoint
+
+    @instrument("upload_resumable")
+    def upload_resumable(
+        self,
+        path: Path,
+        source: str,
+        checkpoints: Optional[CheckpointStore] = None,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+    ) -> FileInfo:
+        """
+        Upload the local file source with a multipart upload of chunk_size
+        parts (raised to 5 MiB), skipping the parts confirmed in the checkpoint
+        of an interrupted try. Each part and the assembled object are verified
+        with their md5 etags.
+        """
+        from botocore.exceptions import ClientError
+
+        # S3 rejects smaller parts (but the last) only on completion
+        chunk_size = max(chunk_size, S3_MIN_PART_SIZE)
+        checkpoints = checkpoints or CheckpointStore()
+        client = self.fs.client
+        bucket = self.fs._bucket_name
+        key = self.fs._path_to_key(str(path))
+        checkpoint_key = f"{self.path}|{path}"
+        try:
+            checkpoint = self._resume_multipart_upload(
+                key, checkpoints.load(checkpoint_key, source), chunk_size
+            )
+            if checkpoint is None:
+                checkpoint = checkpoints.get_source_checkpoint(source)
+                checkpoint.chunk_size = chunk_size
+                checkpoint.upload_id = client.create_multipart_upload(
+                    Bucket=bucket, Key=key, **self.fs._get_upload_args(key)
+                )["UploadId"]
+                checkpoints.save(checkpoint_key, checkpoint)
+            else:
+                logger.info("resume {} with {} parts", path, len(checkpoint.parts))
+            uploaded = {part.part_number for part in checkpoint.parts}
+            num_parts = max(1, -(-checkpoint.size_bytes // chunk_size))
+            with open(source, "rb") as src:
+                for part_number in range(1, num_parts + 1):
+                    if part_number in uploaded:
+                        continue
+                    src.seek((part_number - 1) * chunk_size)
+                    data = src.read(chunk_size)
+                    response = client.upload_part(
+                        Bucket=bucket,
+                        Key=key,
+                        PartNumber=part_number,
+                        UploadId=checkpoint.upload_id,
+                        Body=data,
+                    )
+                    record_bytes(len(data))
+                    etag = response["ETag"].strip('"')
+                    if etag != md5(data).hexdigest():
+                        raise FileSystemSyncError(
+                            f"integrity check of {path} part {part_number} failed!"
+                        )
+                    checkpoint.parts.append(
+                        PartCheckpoint(
+                            part_number=part_number, etag=etag, size_bytes=len(data)
+                        )
+                    )
+                    checkpoints.save(checkpoint_key, checkpoint)
+            parts = sorted(checkpoint.parts, key=lambda part: part.part_number)
+            expected_sizes = [
+                min(chunk_size, checkpoint.size_bytes - offset)
+                for offset in range(0, max(checkpoint.size_bytes, 1), chunk_size)
+            ]
+            if [part.part_number for part in parts] != list(
+                range(1, num_parts + 1)
+            ) or [part.size_bytes for part in parts] != expected_sizes:
+                # never replace the object with a wrong assembly
+                assert checkpoint.upload_id is not None
+                self._abort_multipart_upload(key, checkpoint.upload_id)
+                checkpoints.remove(checkpoint_key)
+                raise FileSystemSyncError(f"parts of {path} do not match its size!")
+            try:
+                client.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=checkpoint.upload_id,
+                    MultipartUpload={
+                        "Parts": [
+                            {"PartNumber": part.part_number, "ETag": f'"{part.etag}"'}
+                            for part in parts
+                        ]
+                    },
+                )
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code in S3_FATAL_COMPLETE_ERRORS:
+                    # a retry would fail the same way, drop the upload
+                    assert checkpoint.upload_id is not None
+                    self._abort_multipart_upload(key, checkpoint.upload_id)
+                    checkpoints.remove(checkpoint_key)
+                raise
+        except (ClientError, OSError) as e:
+            raise FileSystemError(str(e))
+        checkpoints.remove(checkpoint_key)
+
+        file_info = self.getinfo(path)
+        expected_etag = "{}-{}".format(
+            md5(b"".join(bytes.fromhex(part.etag) for part in parts)).hexdigest(),
+            len(parts),
+        )
+        if file_info.size_bytes != checkpoint.size_bytes or (
+            file_info.checksum
+            and "-" in file_info.checksum
+            and file_info.checksum != expected_etag
+        ):
+            raise FileSystemSyncError(f"integrity check of {path} failed!")
+        return file_info
+
+    def _apply_delta(
+        self,
+        path: Path,
+        data: memoryview,
+        ops: List[DeltaOp],
+        old: BlockSignatures,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+    ) -> Optional[FileInfo]:
+        """
+        Rebuild the object with a multipart upload, unchanged ranges are
+        copied from the old object by upload_part_copy (if it is still the
+        same etag). Each part is verified with the md5 of the local data.
+        """
+        from botocore.exceptions import ClientError
+
+        parts = group_parts(
+            ops, S3_MIN_PART_SIZE, max(chunk_size, S3_MIN_PART_SIZE), S3_MAX_PART_SIZE
+        )
+        if all(part.source_offset is None for part in parts):
+            return None
+        client = self.fs.client
+        bucket = self.fs._bucket_name
+        key = self.fs._path_to_key(str(path))
+        try:
+            upload_id = client.create_multipart_upload(
+                Bucket=bucket, Key=key, **self.fs._get_upload_args(key)
+            )["UploadId"]
+        except ClientError as e:
+            raise FileSystemError(str(e))
+        etags = []
+        try:
+            for part_number, part in enumerate(parts, 1):
+                block = data[part.offset : part.offset + part.length]
+                if part.source_offset is None:
+                    response = client.upload_part(
+                        Bucket=bucket,
+                        Key=key,
+                        PartNumber=part_number,
+                        UploadId=upload_id,
+                        Body=bytes(block),
+                    )
+                    record_bytes(part.length)
+                    etag = response["ETag"].strip('"')
+                else:
+                    # fail instead of copying from another version
+                    copy_args = (
+                        {"CopySourceIfMatch": old.checksum} if old.checksum else {}
+                    )
+                    response = client.upload_part_copy(
+                        Bucket=bucket,
+                        Key=key,
+                        PartNumber=part_number,
+                        UploadId=upload_id,
+                        CopySource={"Bucket": bucket, "Key": key},
+                        CopySourceRange="bytes={}-{}".format(
+                            part.source_offset, part.source_offset + part.length - 1
+                        ),
+                        **copy_args,
+                    )
+                    etag = response["CopyPartResult"]["ETag"].strip('"')
+                if etag != md5(block).hexdigest():
+                    raise FileSystemSyncError(
+                        f"integrity check of {path} part {part_number} failed!"
+                    )
+                etags.append(etag)
+            client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"PartNumber": part_number, "ETag": f'"{etag}"'}
+                        for part_number, etag in enumerate(etags, 1)
+                    ]
+                },
+            )
+        except (ClientError, FileSystemSyncError) as e:
+            try:
+                client.abort_multipart_upload(
+                    Bucket=bucket, Key=key, UploadId=upload_id
+                )
+            except ClientError:
+                logger.warning("failed to abort the upload of {}", path)
+            if isinstance(e, FileSystemSyncError):
+                raise
+            raise FileSystemError(str(e))
+
+        file_info = self.getinfo(path)
+        expected_etag = "{}-{}".format(
+            md5(b"".join(bytes.fromhex(etag) for etag in etags)).hexdigest(),
+            len(etags),
+        )
+        if file_info.size_bytes != len(data) or (
+            file_info.checksum
+            and "-" in file_info.checksum
+            and file_info.checksum != expected_etag
+        ):
+            raise FileSystemSyncError(f"integrity check of {path} failed!")
+        return file_info
+
     # def download(self, remote_path: Path, local_path: Path):
 
     def extract_all(self) -> None:
@@ -133,6 +919,8 @@ class LakeFSStorage(S3Storage):
         branch_name: str = "master",
         username: Optional[str] = None,
         password: Optional[str] = None,
+        lakefs_client: Optional["LakeFSClient"] = None,
+        rate_control: bool = True,
     ) -> None:
         super().__init__(
             host_in_config,
@@ -141,7 +929,185 @@ class LakeFSStorage(S3Storage):
             username,
             password,
             endpoint_url,
+            rate_control,
+        )
+        self.host_in_config = host_in_config
+        self.endpoint_url = endpoint_url
+        self.repo_name = repo_name
+        self.branch_name = branch_name
+        self.username = username
+        self.password = password
+        self.lakefs_client = lakefs_client
+
+    @property
+    def api(self) -> "LakeFSClient":
+        if self.lakefs_client is None:
+            raise FileSystemUndefinedError("lakeFS api client not defined!")
+        return self.lakefs_client
+
+    @contextmanager
+    def _api_errors(self) -> Iterator[None]:
+        from lakefs_client.exceptions import OpenApiException
+
+        try:
+            yield
+        except OpenApiException as e:
+            raise FileSystemError(str(e))
+
+    def with_branch(self, branch_name: str) -> "LakeFSStorage":
+        """Open another branch of the same repository."""
+        return LakeFSStorage(
+            self.host_in_config,
+            self.endpoint_url,
+            self.repo_name,
+            branch_name,
+            self.username,
+            self.password,
+            self.lakefs_client,
+            self.rate_controller is not None,
+        )
+
+    @instrument("create_branch")
+    def create_branch(
+        self, branch_name: str, source_ref: Optional[str] = None
+    ) -> "LakeFSStorage":
+        """Create a branch from source_ref (default: this branch), no data is copied."""
+        from lakefs_client import models
+
+        branch_creation = models.BranchCreation(
+            name=branch_name, source=source_ref or self.branch_name
+        )
+        with self._api_errors():
+            self.api.branches.create_branch(self.repo_name, branch_creation)
+        return self.with_branch(branch_name)
+
+    def delete_branch(self) -> None:
+        with self._api_errors():
+            self.api.branches.delete_branch(self.repo_name, self.branch_name)
+
+    @instrument("commit")
+    def commit(self, message: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        """Commit staged changes of this branch, return the commit id."""
+        from lakefs_client import models
+
+        commit_creation = models.CommitCreation(
+            message=message, metadata=metadata or {}
         )
+        with self._api_errors():
+            commit = self.api.commits.commit(
+                self.repo_name, self.branch_name, commit_creation
+            )
+        return commit.id
+
+    @instrument("merge_into")
+    def merge_into(self, dest_branch: str, message: str = "") -> str:
+        """Merge this branch into dest_branch, return the merge commit reference."""
+        from lakefs_client import models
+
+        with self._api_errors():
+            result = self.api.refs.merge_into_branch(
+                self.repo_name,
+                self.branch_name,
+                dest_branch,
+                merge=models.Merge(message=message),
+            )
+        return result.reference
+
+    def diff(
+        self,
+        source_ref: str,
+        prefix: str = "",
+        amount: int = 1000,
+        diff_type: str = "three_dot",
+    ) -> Iterator[DiffEntry]:
+        """
+        Yield the committed changes between this branch and source_ref. By
+        default (three_dot) the changes a merge of source_ref would apply,
+        with two_dot every difference between the two commits.
+        """
+        after = ""
+        while True:
+            with self._api_errors():
+                response = self.api.refs.diff_refs(
+                    self.repo_name,
+                    self.branch_name,
+                    source_ref,
+                    after=after,
+                    amount=amount,
+                    prefix=prefix,
+                    diff_type=diff_type,
+                )
+            for result in response.results:
+                if result.path_type != "object":
+                    continue
+                yield DiffEntry(
+                    type=result.type,
+                    path=result.path,
+                    size_bytes=result.get("size_bytes"),
+                )
+            if not response.pagination.has_more:
+                break
+            after = response.pagination.next_offset
+
+    def head_commit(self, branch_name: Optional[str] = None) -> str:
+        """Id of the last commit of a branch (default: this branch)."""
+        with self._api_errors():
+            return self.api.branches.get_branch(
+                self.repo_name, branch_name or self.branch_name
+            ).commit_id
+
+    def has_uncommitted(self) -> bool:
+        with self._api_errors():
+            response = self.api.branches.diff_branch(
+                self.repo_name, self.branch_name, amount=1
+            )
+        return bool(response.results)
+
+    @instrument("sync_from")
+    def sync_from(
+        self, source: "LakeFSStorage", commit_id: Optional[str] = None
+    ) -> List[DiffEntry]:
+        """
+        Make the last commit of this branch match a commit of source (in the
+        same repo, default: its last commit) by staging the differences on
+        this branch; uncommitted changes of source are not synced.
+
+        Objects are copied server side from the commit, which fails before
+        writing anything if this branch has uncommitted changes. The lakeFS
+        api of this storage is used, source may have no client.
+        """
+        from botocore.exceptions import ClientError
+
+        if source.repo_name != self.repo_name:
+            raise FileSystemSyncError("sync failed, branches in different repos!")
+        if self.has_uncommitted():
+            raise FileSystemSyncError(
+                f"sync failed, branch {self.branch_name} has uncommitted changes!"
+            )
+        commit_id = commit_id or self.head_commit(source.branch_name)
+        changes = list(self.diff(commit_id, diff_type="two_dot"))
+        conflicts = [
+            change.path for change in changes if change.type == DiffType.conflict
+        ]
+        if conflicts:
+            raise FileSystemSyncError(f"sync failed, conflict on {conflicts[0]}!")
+        for change in changes:
+            key = f"{self.branch_name}/{change.path}"
+            try:
+                if change.type == DiffType.removed:
+                    self.fs.client.delete_object(Bucket=self.repo_name, Key=key)
+                else:
+                    self.fs.client.copy_object(
+                        Bucket=self.repo_name,
+                        Key=key,
+                        CopySource={
+                            "Bucket": self.repo_name,
+                            "Key": f"{commit_id}/{change.path}",
+                        },
+                    )
+            except ClientError as e:
+                raise FileSystemError(str(e))
+        return changes
 
 
 class LocalStorage(Storage):
@@ -154,6 +1120,8 @@ class LocalStorage(Storage):
 
 class TempStorage(Storage):
     def __init__(self) -> None:
+        from fs.tempfs import TempFS
+
         self._fs = TempFS()
         super().__init__(self._fs.getsyspath("/"))
 
@@ -167,28 +1135,157 @@ class ArchiveStorage(TempStorage):
         self.file_path = file_path
 
     def extract_all(self) -> None:
+        import patoolib
+
         try:
             patoolib.extract_archive(self.file_path, outdir=self.path)
         except Exception as e:
             raise ArchiveError(str(e))
 
     def compress_all(self) -> None:
+        import patoolib
+
         try:
             patoolib.create_archive(self.file_path, [self.path])
         except Exception as e:
             raise ArchiveError(str(e))
 
 
-class CodeTextStorage(TempStorage):
-    def __init__(self, filename: str, code_text: str) -> None:
-        super().__init__()
-        self.fs.writetext(filename, code_text)
+class MemoryStorage(TempStorage):
+    """
+    Storage kept in memory until it grows larger than spill_threshold bytes,
+    then moved to a TempFS so that rclone and os level tools can access it.
+    It is a TempStorage (as submission storages were before) which starts
+    in memory.
+
+    Write through the methods of this class (not self.fs) so that the size is
+    tracked. Until spilled, path is empty and Manager syncs it with sync_all_to.
+    Writes, deletes and the spill take a lock, so threads may share it.
+    """
+
+    def __init__(self, spill_threshold: int = SPILL_THRESHOLD) -> None:
+        from fs.memoryfs import MemoryFS
+
+        # the TempFS of TempStorage is only created when spilling
+        Storage.__init__(self, "")
+        self._fs = MemoryFS()
+        self.spill_threshold = spill_threshold
+        self.size_bytes = 0
+        self._sizes: Dict[str, int] = {}
+        # reentrant: writes spill while holding it
+        self._lock = threading.RLock()
+
+    @property
+    def in_memory(self) -> bool:
+        from fs.memoryfs import MemoryFS
+
+        return isinstance(self._fs, MemoryFS)
+
+    def spill(self) -> None:
+        """Move all files to a temporary directory on disk."""
+        from fs.copy import copy_fs
+        from fs.tempfs import TempFS
+
+        with self._lock:
+            if not self.in_memory:
+                return
+            temp_fs = TempFS()
+            try:
+                copy_fs(self.fs, temp_fs)
+            except FSError as e:
+                temp_fs.close()
+                raise FileSystemError(str(e))
+            self.fs.close()
+            self._fs = temp_fs
+            self.path = temp_fs.getsyspath("/")
+
+    def _set_size(self, path: Path, size: int) -> None:
+        key = str(path).lstrip("/")
+        self.size_bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        if self.in_memory and self.size_bytes > self.spill_threshold:
+            self.spill()
+
+    def _forget_sizes(self, path: Path, tree: bool = False) -> None:
+        key = str(path).strip("/")
+        for file_path in list(self._sizes):
+            if file_path == key or (tree and file_path.startswith(f"{key}/")):
+                self.size_bytes -= self._sizes.pop(file_path)
+
+    def write_bytes(self, path: Path, data: bytes) -> None:
+        with self._lock:
+            try:
+                self.fs.makedirs(path=str(path.parent), recreate=True)
+                self.fs.writebytes(str(path), data)
+            except FSError as e:
+                raise FileSystemError(str(e))
+            self._set_size(path, len(data))
+
+    def upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        with self._lock:
+            file_info = super().upload(path, file, chunk_size, metadata)
+            self._set_size(path, file_info.size_bytes or 0)
+        return file_info
+
+    def delete(self, path: Path) -> FileInfo:
+        with self._lock:
+            file_info = super().delete(path)
+            self._forget_sizes(path)
+        return file_info
+
+    def delete_tree(self, path: Path) -> FileInfo:
+        with self._lock:
+            file_info = super().delete_tree(path)
+            self._forget_sizes(path, tree=True)
+        return file_info
+
+
+class CodeTextStorage(MemoryStorage):
+    def __init__(
+        self, filename: str, code_text: str, spill_threshold: int = SPILL_THRESHOLD
+    ) -> None:
+        super().__init__(spill_threshold)
+        self.write_bytes(Path(filename), code_text.encode("utf-8"))
         self.filename = filename
 
+    @classmethod
+    def create_many(
+        cls,
+        submissions: Iterable[Tuple[str, str]],
+        spill_threshold: int = SPILL_THRESHOLD,
+    ) -> List["CodeTextStorage"]:
+        """Create one storage per (filename, code_text) submission."""
+        return [
+            cls(filename, code_text, spill_threshold)
+            for filename, code_text in submissions
+        ]
 
-class MultipleFilesStorage(TempStorage):
-    def __init__(self, filenames: List[str], files: List[IO[bytes]]) -> None:
-        super().__init__()
+
+class MultipleFilesStorage(MemoryStorage):
+    def __init__(
+        self,
+        filenames: List[str],
+        files: List[IO[bytes]],
+        spill_threshold: int = SPILL_THRESHOLD,
+    ) -> None:
+        super().__init__(spill_threshold)
         for filename, file in zip(filenames, files):
-            self.fs.writefile(filename, file)
+            self.upload(Path(filename), cast(BinaryIO, file))
         self.filenames = filenames
+
+    @classmethod
+    def create_many(
+        cls,
+        submissions: Iterable[Tuple[List[str], List[IO[bytes]]]],
+        spill_threshold: int = SPILL_THRESHOLD,
+    ) -> List["MultipleFilesStorage"]:
+        """Create one storage per (filenames, files) submission."""
+        return [
+            cls(filenames, files, spill_threshold) for filenames, files in submissions
+        ]
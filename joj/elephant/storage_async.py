@@ -0,0 +1,228 @@
+import asyncio
+import contextvars
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from joj.elephant.errors import ElephantError
+from joj.elephant.schemas import FileInfo
+from joj.elephant.storage import Storage
+
+T = TypeVar("T")
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+
+class BatchResult(NamedTuple):
+    path: Path
+    file_info: Optional[FileInfo] = None
+    error: Optional[ElephantError] = None
+
+
+class _Slots:
+    """A semaphore handing free slots to the waiting threads in FIFO order."""
+
+    def __init__(self, value: int) -> None:
+        self._lock = threading.Lock()
+        self._value = value
+        self._waiters: Deque[threading.Event] = deque()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._value and not self._waiters:
+                self._value -= 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        waiter.wait()
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # the slot goes to the oldest waiter, never to a new acquire
+                self._waiters.popleft().set()
+            else:
+                self._value += 1
+
+    def __enter__(self) -> None:
+        self.acquire()
+
+    def __exit__(self, *args: Any) -> None:
+        self.release()
+
+
+class AsyncStorage:
+    """
+    Asyncio wrapper for any Storage.
+
+    Blocking calls run on thread pools, at most max_concurrency at a time for
+    the whole AsyncStorage. The *_many methods yield a BatchResult as soon as
+    each operation is done, so results arrive in completion order rather
+    than input order.
+
+    A batch is not one executor hop per item: it starts max_concurrency jobs
+    on a pool of its own which take items from the input one after another,
+    and items are only read from the input as jobs become free. Every item
+    and every single call takes one of the max_concurrency slots, handed out
+    in FIFO order, so a call made during a batch waits for one item rather
+    than for the whole batch, and concurrent batches interleave. The backends
+    are blocking (aiofiles would also wrap a thread pool for every call), so
+    this is the native path for all of them.
+    """
+
+    def __init__(
+        self, storage: Storage, max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be positive!")
+        self.storage = storage
+        self.max_concurrency = max_concurrency
+        self._slots = _Slots(max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="elephant-storage"
+        )
+
+    def _call(self, func: Callable[..., T], *args: Any) -> T:
+        with self._slots:
+            return func(*args)
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        # keep context variables (e.g. the current trace span) in the thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, partial(context.run, self._call, func, *args)
+        )
+
+    async def _run_many(
+        self,
+        func: Callable[..., Optional[FileInfo]],
+        items: Iterable[Tuple[Any, ...]],
+    ) -> AsyncIterator[BatchResult]:
+        loop = asyncio.get_running_loop()
+        # a result, an unexpected error, or None when a job is done
+        queue: "asyncio.Queue[Union[BatchResult, BaseException, None]]"
+        queue = asyncio.Queue()
+        iterator = iter(items)
+        lock = threading.Lock()
+        stopped = threading.Event()
+
+        def put(value: Union[BatchResult, BaseException, None]) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, value)
+            except RuntimeError:
+                # the loop was closed after the consumer stopped
+                pass
+
+        def job() -> None:
+            try:
+                while not stopped.is_set():
+                    with self._slots:
+                        with lock:
+                            item = next(iterator, None)
+                        if item is None:
+                            break
+                        path, *args = item
+                        try:
+                            result = BatchResult(path=path, file_info=func(path, *args))
+                        except ElephantError as e:
+                            result = BatchResult(path=path, error=e)
+                    put(result)
+            except BaseException as e:
+                stopped.set()
+                put(e)
+            finally:
+                put(None)
+
+        # jobs of a batch run until its input is exhausted, they must not
+        # hold the workers of single calls and other batches
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="elephant-batch"
+        )
+        for _ in range(self.max_concurrency):
+            # keep context variables (e.g. the current trace span) in the jobs
+            context = contextvars.copy_context()
+            loop.run_in_executor(executor, partial(context.run, job))
+        running = self.max_concurrency
+        try:
+            while running:
+                value = await queue.get()
+                if value is None:
+                    running -= 1
+                elif isinstance(value, BaseException):
+                    raise value
+                else:
+                    yield value
+        finally:
+            # the consumer stopped early or an unexpected error was raised,
+            # jobs finish their current item
+            stopped.set()
+            executor.shutdown(wait=False)
+
+    async def getinfo(self, path: Path) -> FileInfo:
+        return await self._run(self.storage.getinfo, path)
+
+    async def upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        return await self._run(self.storage.upload, path, file, chunk_size, metadata)
+
+    async def download(
+        self, path: Path, file: BinaryIO, chunk_size: Optional[int] = None
+    ) -> None:
+        await self._run(self.storage.download, path, file, chunk_size)
+
+    async def read_range(
+        self, path: Path, offset: int, length: Optional[int] = None
+    ) -> bytes:
+        return await self._run(self.storage.read_range, path, offset, length)
+
+    async def delete(self, path: Path) -> FileInfo:
+        return await self._run(self.storage.delete, path)
+
+    async def delete_dir(self, path: Path) -> FileInfo:
+        return await self._run(self.storage.delete_dir, path)
+
+    async def delete_tree(self, path: Path) -> FileInfo:
+        return await self._run(self.storage.delete_tree, path)
+
+    def getinfo_many(self, paths: Iterable[Path]) -> AsyncIterator[BatchResult]:
+        return self._run_many(self.storage.getinfo, ((path,) for path in paths))
+
+    def upload_many(
+        self, files: Iterable[Tuple[Path, BinaryIO]]
+    ) -> AsyncIterator[BatchResult]:
+        return self._run_many(self.storage.upload, files)
+
+    def download_many(
+        self, files: Iterable[Tuple[Path, BinaryIO]]
+    ) -> AsyncIterator[BatchResult]:
+        """Download into the given files, file_info is always None."""
+        return self._run_many(self.storage.download, files)
+
+    def delete_many(self, paths: Iterable[Path]) -> AsyncIterator[BatchResult]:
+        return self._run_many(self.storage.delete, ((path,) for path in paths))
+
+    async def close(self) -> None:
+        await self._run(self.storage.close)
+        self._executor.shutdown(wait=False)
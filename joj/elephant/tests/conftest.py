@@ -1,9 +1,15 @@
+import os
+import socket
+import urllib.request
+from typing import Iterator
+
 import boto3
 import pytest
 from lakefs_client import Configuration
 from lakefs_client.client import LakeFSClient
 from loguru import logger
 
+from joj.elephant.storage import S3Storage
 from joj.elephant.tests.config import Settings
 
 
@@ -51,3 +57,38 @@ def lakefs_client(settings: Settings) -> LakeFSClient:
         password=settings.lakefs_password,
     )
     return LakeFSClient(configuration)
+
+
+@pytest.fixture
+def s3_storage() -> Iterator[S3Storage]:
+    """An S3Storage on a new bucket of an in-process moto server."""
+    from moto.server import ThreadedMotoServer
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    endpoint_url = f"http://127.0.0.1:{port}"
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    try:
+        boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        ).create_bucket(Bucket="test")
+        storage = S3Storage(
+            host_in_config="moto",
+            bucket_name="test",
+            username="test",
+            password="test",
+            endpoint_url=endpoint_url,
+        )
+        yield storage
+        storage.close()
+    finally:
+        # the backends of moto are shared by all servers of the process
+        reset = urllib.request.Request(f"{endpoint_url}/moto-api/reset", method="POST")
+        urllib.request.urlopen(reset).close()
+        server.stop()
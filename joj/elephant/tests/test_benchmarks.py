@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from joj.elephant.benchmarks.runner import (
+    BenchmarkReport,
+    BenchmarkResult,
+    compare_reports,
+    dump_report,
+    load_report,
+    run_benchmarks,
+)
+
+
+def test_run_benchmarks(tmp_path: Path) -> None:
+    names = ["sync_small_files", "gitignore", "config_validation", "file_listing"]
+    report = run_benchmarks(str(tmp_path), scale=0.01, names=names)
+    assert {result.name for result in report.results} == set(names)
+    assert all(result.skipped is None for result in report.results)
+    assert load_report(dump_report(report)) == report
+
+
+def test_throughput_sizes_unique(tmp_path: Path) -> None:
+    # 64 MiB scaled down is clamped to 1 MiB, which is measured already
+    report = run_benchmarks(str(tmp_path), scale=0.01, names=["local_throughput"])
+    keys = [result.key for result in report.results]
+    assert len(keys) == len(set(keys)) == 4
+
+
+def test_compare_reports() -> None:
+    baseline = BenchmarkReport(
+        results=[
+            BenchmarkResult(name="a", params={"size": 1}, seconds=1.0),
+            BenchmarkResult(name="b", seconds=1.0),
+        ]
+    )
+    report = BenchmarkReport(
+        results=[
+            BenchmarkResult(name="a", params={"size": 1}, seconds=1.3),
+            BenchmarkResult(name="b", seconds=1.3),
+            BenchmarkResult(name="c", seconds=100.0),
+        ]
+    )
+    regressions = compare_reports(report, baseline, 0.25, {"a": 0.5})
+    assert [regression.key for regression in regressions] == ["b"]
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import orjson
+import pytest
+
+from joj.elephant.benchmarks.fake_rclone import install_fake_rclone
+from joj.elephant.bulk import (
+    BulkAction,
+    _init_worker,
+    _run_problem,
+    list_problems,
+    open_storage,
+    run_bulk,
+)
+from joj.elephant.errors import FileSystemError
+from joj.elephant.schemas import Config
+from joj.elephant.storage import LocalStorage, S3Storage
+
+
+@pytest.fixture
+def problems(tmp_path: Path) -> Path:
+    root = tmp_path / "problems"
+    for name in ("a1", "a2", "b1"):
+        (root / name).mkdir(parents=True)
+        (root / name / "config.json").write_bytes(
+            orjson.dumps(Config.generate_default_value().dict())
+        )
+        (root / name / "1.in").write_text(name)
+    (root / "a2" / "config.json").write_text("{")
+    return root
+
+
+def test_list_problems(problems: Path) -> None:
+    assert list_problems(str(problems), "", {}) == ["a1", "a2", "b1"]
+    assert list_problems(str(problems), "a", {}) == ["a1", "a2"]
+
+
+def test_open_storage() -> None:
+    remotes = {"s3": {"type": "s3", "endpoint": "http://s3"}}
+    storage = open_storage("s3:bucket/problems", "a1", remotes)
+    assert isinstance(storage, S3Storage)
+    assert storage.path == "s3:bucket/problems/a1"
+    assert storage.fs.endpoint_url == "http://s3"
+    with pytest.raises(FileSystemError):
+        open_storage("gcs:bucket", "a1", remotes)
+
+
+def test_bulk_validate(problems: Path) -> None:
+    report = run_bulk(BulkAction.validate, str(problems), ["a1", "a2", "b1"], jobs=2)
+    assert [result.problem for result in report.results] == ["a1", "a2", "b1"]
+    assert report.succeeded == 2 and report.failed == 1
+    assert not report.results[1].ok and report.results[1].error
+
+
+def test_bulk_sync(problems: Path, tmp_path: Path) -> None:
+    dest = tmp_path / "dest"
+    with install_fake_rclone(str(tmp_path / "bin")):
+        report = run_bulk(
+            BulkAction.sync, str(problems), ["a1", "b1"], dest=str(dest), jobs=2
+        )
+    assert report.failed == 0, report.results
+    assert (dest / "a1" / "1.in").read_text() == "a1"
+    assert isinstance(open_storage(str(dest), "b1", {}), LocalStorage)
+    assert (dest / "b1" / "1.in").read_text() == "b1"
+
+
+def test_run_problem_unexpected_error(problems: Path) -> None:
+    # a json list breaks Config(**data) with a TypeError
+    (problems / "b1" / "config.json").write_text("[1]")
+    _init_worker("")
+    result = _run_problem(BulkAction.validate, str(problems), None, "b1")
+    assert not result.ok and result.error and result.error.startswith("TypeError")
@@ -0,0 +1,73 @@
+import os
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from joj.elephant.storage import LocalStorage, S3Storage, TempStorage
+
+pytest.importorskip("zstandard")
+
+from joj.elephant.compression import (  # noqa: E402
+    CODEC_KEY,
+    ZSTD_MAGIC,
+    CompressedStorage,
+)
+
+TEXT = b"".join(b"%d %d\n" % (i, i * i) for i in range(100000))
+
+
+@pytest.fixture
+def storage() -> CompressedStorage:
+    return CompressedStorage(TempStorage())
+
+
+def test_compressed_round_trip(storage: CompressedStorage) -> None:
+    file_info = storage.upload(Path("data/1.in"), BytesIO(TEXT))
+    assert file_info.size_bytes == len(TEXT)
+    stored_size = storage.storage.getinfo(Path("data/1.in")).size_bytes
+    assert stored_size is not None and stored_size < len(TEXT) // 2
+
+    file_info = storage.getinfo(Path("data/1.in"))
+    assert file_info.size_bytes == len(TEXT)
+    assert file_info.metadata[CODEC_KEY] == "zstd"
+    output = BytesIO()
+    storage.download(Path("data/1.in"), output, chunk_size=4096)
+    assert output.getvalue() == TEXT
+    assert storage.read_range(Path("data/1.in"), 100, 20) == TEXT[100:120]
+
+
+def test_list_compact(storage: CompressedStorage) -> None:
+    storage.upload(Path("data/1.in"), BytesIO(TEXT))
+    entries = {entry.path: entry for entry in storage.list_compact()}
+    assert entries["data"].is_dir
+    assert entries["data/1.in"].size_bytes == len(TEXT)
+
+
+@pytest.mark.parametrize(
+    "data,codec",
+    [(os.urandom(100000), "none"), (ZSTD_MAGIC + b"raw", "zstd"), (b"", "none")],
+)
+def test_stored_codec(storage: CompressedStorage, data: bytes, codec: str) -> None:
+    storage.upload(Path("1.out"), BytesIO(data))
+    file_info = storage.getinfo(Path("1.out"))
+    assert file_info.metadata[CODEC_KEY] == codec
+    assert file_info.size_bytes == len(data)
+    output = BytesIO()
+    storage.download(Path("1.out"), output)
+    assert output.getvalue() == data
+
+
+def test_copy_to(storage: CompressedStorage, tmp_path: Path) -> None:
+    storage.upload(Path("1.in"), BytesIO(TEXT))
+    storage.copy_to(Path("1.in"), LocalStorage(str(tmp_path)))
+    assert (tmp_path / "1.in").read_bytes() == TEXT
+
+
+def test_s3_metadata(s3_storage: S3Storage) -> None:
+    storage = CompressedStorage(s3_storage)
+    storage.upload(Path("1.in"), BytesIO(TEXT))
+    metadata = s3_storage.getinfo(Path("1.in")).metadata
+    assert metadata == {CODEC_KEY: "zstd", "elephant-size": str(len(TEXT))}
+    assert storage.getinfo(Path("1.in")).size_bytes == len(TEXT)
+    assert storage.read_range(Path("1.in"), 0, 4) == TEXT[:4]
@@ -0,0 +1,88 @@
+import time
+from typing import Any, Dict, List
+
+from joj.elephant.config_diff import diff_configs, referenced_files
+from joj.elephant.schemas import Config, DiffType
+
+
+def make_config(cases: List[Dict[str, Any]], **language: Any) -> Config:
+    return Config.parse_obj(
+        {
+            "languages": [{"name": "c++", "cases": cases, **language}],
+            "language_default": {
+                "case_default": {"time": "1s", "memory": "64m", "category": "pretest"}
+            },
+        }
+    )
+
+
+def case(i: int, **fields: Any) -> Dict[str, Any]:
+    return {
+        "execute_input_file": f"{i}.in",
+        "execute_output_file": f"{i}.out",
+        **fields,
+    }
+
+
+def test_no_change() -> None:
+    config = make_config([case(1), case(2)])
+    diff = diff_configs(config, make_config([case(1), case(2)]))
+    assert diff.empty and diff.rejudge_cases() == {}
+
+
+def test_defaults_resolved() -> None:
+    old = make_config([case(1, time="1s")])
+    assert diff_configs(old, make_config([case(1)])).empty
+
+
+def test_cases() -> None:
+    old = make_config([case(1), case(2), case(3)])
+    new = make_config([case(1), case(2, time="2s"), case(3), case(4)])
+    diff = diff_configs(old, new)
+    [language] = diff.languages
+    assert language.type == DiffType.changed and language.fields == []
+    assert [(c.index, c.type, c.fields) for c in language.cases] == [
+        (1, DiffType.changed, ["time"]),
+        (3, DiffType.added, []),
+    ]
+    assert diff.added_files == ["4.in", "4.out"] and diff.removed_files == []
+    assert diff.rejudge_cases() == {"c++": [1, 3]}
+    assert diff.sync_files() == ["4.in", "4.out"]
+
+    diff = diff_configs(new, old)
+    assert [(c.index, c.type) for c in diff.languages[0].cases] == [
+        (1, DiffType.changed),
+        (3, DiffType.removed),
+    ]
+    assert diff.removed_files == ["4.in", "4.out"]
+    assert diff.rejudge_cases() == {"c++": [1]}
+
+
+def test_changed_files() -> None:
+    config = make_config([case(1), case(2)])
+    diff = diff_configs(config, config, changed_files=["/2.in", "other.txt"])
+    [language] = diff.languages
+    assert [(c.index, c.fields, c.files) for c in language.cases] == [(1, [], ["2.in"])]
+    assert diff.changed_files == ["2.in"] and diff.sync_files() == ["2.in"]
+
+
+def test_languages() -> None:
+    old = make_config([case(1), case(2)])
+    new = make_config([case(1), case(2)], compile_args=["g++", "a.cpp"])
+    new.languages.append(new.languages[0].copy(update={"name": "c"}))
+    diff = diff_configs(old, new)
+    assert [(lang.name, lang.type, lang.fields) for lang in diff.languages] == [
+        ("c++", DiffType.changed, ["compile_args"]),
+        ("c", DiffType.added, []),
+    ]
+    assert diff.rejudge_cases() == {"c++": [0, 1], "c": [0, 1]}
+    assert referenced_files(new) >= {"a.cpp", "1.in", "2.out"}
+
+
+def test_large_config() -> None:
+    old = make_config([case(i) for i in range(10000)])
+    new = make_config([case(i, score=5 if i == 5000 else 10) for i in range(10000)])
+    start = time.perf_counter()
+    diff = diff_configs(old, new)
+    assert time.perf_counter() - start < 5
+    assert diff.rejudge_cases() == {"c++": [5000]}
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from joj.elephant.delta import (
+    DeltaOp,
+    SignatureStore,
+    compute_delta,
+    compute_signatures,
+    group_parts,
+)
+from joj.elephant.metrics import TracingHook, add_hook, remove_hook
+from joj.elephant.storage import LocalStorage, S3Storage
+
+KiB = 1024
+MiB = 1024 * 1024
+
+
+def apply_ops(old: bytes, new: bytes, ops: List[DeltaOp]) -> bytes:
+    return b"".join(
+        new[op.offset : op.offset + op.length]
+        if op.source_offset is None
+        else old[op.source_offset : op.source_offset + op.length]
+        for op in ops
+    )
+
+
+@pytest.fixture
+def old() -> bytes:
+    return os.urandom(64 * KiB + 100)
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda data: data[:5000] + b"x" * 10 + data[5010:],
+        lambda data: data[:5000] + b"inserted" + data[5000:],
+        lambda data: data[:5000] + data[5300:],
+        lambda data: b"head" + data + b"tail",
+    ],
+)
+def test_compute_delta(old: bytes, edit: object) -> None:
+    new = edit(old)  # type: ignore
+    ops = compute_delta(memoryview(new), compute_signatures(memoryview(old), 4 * KiB))
+    assert apply_ops(old, new, ops) == new
+    literal = sum(op.length for op in ops if op.source_offset is None)
+    assert literal <= 3 * 4 * KiB
+
+
+def test_compute_delta_search_limit(old: bytes) -> None:
+    new = b"inserted" + old
+    signatures = compute_signatures(memoryview(old), 4 * KiB)
+    ops = compute_delta(memoryview(new), signatures, search_limit=0)
+    assert ops == [DeltaOp(0, len(new))]
+
+
+def test_group_parts() -> None:
+    ops = [
+        DeltaOp(0, 6 * MiB, 0),
+        DeltaOp(6 * MiB, 1 * MiB),
+        DeltaOp(7 * MiB, 5 * MiB, 7 * MiB),
+        DeltaOp(12 * MiB, 12 * MiB, 12 * MiB),
+    ]
+    parts = group_parts(ops, 5 * MiB, 8 * MiB, 10 * MiB)
+    assert parts == [
+        DeltaOp(0, 6 * MiB, 0),
+        DeltaOp(6 * MiB, 6 * MiB),
+        DeltaOp(12 * MiB, 6 * MiB, 12 * MiB),
+        DeltaOp(18 * MiB, 6 * MiB, 18 * MiB),
+    ]
+
+
+def test_upload_delta_local(tmp_path: Path) -> None:
+    source = tmp_path / "case.in"
+    data = bytearray(os.urandom(300 * KiB))
+    source.write_bytes(data)
+    os.makedirs(tmp_path / "dest")
+    dest = LocalStorage(str(tmp_path / "dest"))
+    signatures = SignatureStore(str(tmp_path / "signatures"))
+    dest.upload_delta(Path("case.in"), str(source), signatures, block_size=4 * KiB)
+
+    data[100 * KiB : 100 * KiB + 3] = b"abc"
+    source.write_bytes(data)
+    hook = TracingHook()
+    add_hook(hook)
+    try:
+        file_info = dest.upload_delta(
+            Path("case.in"), str(source), signatures, block_size=4 * KiB
+        )
+    finally:
+        remove_hook(hook)
+    assert file_info.size_bytes == len(data)
+    assert (tmp_path / "dest" / "case.in").read_bytes() == data
+    span = [span for span in hook.spans if span.name.endswith(".upload_delta")][0]
+    assert span.attributes["bytes"] == 4 * KiB
+
+
+def test_upload_delta_s3(s3_storage: S3Storage, tmp_path: Path) -> None:
+    source = tmp_path / "case.in"
+    data = bytearray(os.urandom(12 * MiB))
+    source.write_bytes(data)
+    signatures = SignatureStore(str(tmp_path / "signatures"))
+    s3_storage.upload_delta(Path("case.in"), str(source), signatures)
+    data[6 * MiB : 6 * MiB + 10] = b"0123456789"
+    source.write_bytes(data)
+    hook = TracingHook()
+    add_hook(hook)
+    try:
+        file_info = s3_storage.upload_delta(Path("case.in"), str(source), signatures)
+    finally:
+        remove_hook(hook)
+    assert file_info.checksum and file_info.checksum.endswith("-2")
+    assert s3_storage.read_range(Path("case.in"), 0) == data
+    span = [span for span in hook.spans if span.name.endswith(".upload_delta")][0]
+    assert span.attributes["bytes"] == 6 * MiB
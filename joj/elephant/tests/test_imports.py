@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+import pytest
+
+from joj.elephant.benchmarks.fake_rclone import PACKAGE_ROOT
+
+BACKEND_MODULES = ["boto3", "botocore", "fs_s3fs", "patoolib", "gitignore_parser"]
+
+
+@pytest.mark.parametrize("module", ["joj.elephant.schemas", "joj.elephant.manager"])
+def test_backends_imported_lazily(module: str) -> None:
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {BACKEND_MODULES!r} if m in sys.modules))"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PACKAGE_ROOT,
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    )
+    assert process.stdout.strip() == ""
@@ -1,8 +1,16 @@
+from io import BytesIO
+from pathlib import Path
+
 import pytest
 from lakefs_client import __version__, models
 from lakefs_client.client import LakeFSClient
 from loguru import logger
 
+from joj.elephant.errors import FileSystemError, FileSystemSyncError
+from joj.elephant.schemas import DiffType
+from joj.elephant.storage import LakeFSStorage
+from joj.elephant.tests.config import Settings
+
 
 def test_connection(lakefs_client: LakeFSClient) -> None:
     response: models.VersionConfig = lakefs_client.config.get_lake_fs_version()
@@ -29,3 +37,55 @@ def test_create_repo(
     )
     repo = lakefs_client.repositories.create_repository(new_repo)
     assert repo
+
+
+@pytest.mark.depends(on=["test_create_repo"])
+def test_branch_and_sync(lakefs_client: LakeFSClient, settings: Settings) -> None:
+    master = LakeFSStorage(
+        host_in_config="lakefs",
+        endpoint_url=f"{settings.lakefs_host}:{settings.lakefs_port}",
+        repo_name="config",
+        username=settings.lakefs_username,
+        password=settings.lakefs_password,
+        lakefs_client=lakefs_client,
+    )
+    master.upload(Path("1.in"), BytesIO(b"1"))
+    master.upload(Path("2.in"), BytesIO(b"2"))
+    master.commit("add cases")
+
+    draft = master.create_branch("draft")
+    assert draft.getinfo(Path("1.in")).size_bytes == 1
+    draft.upload(Path("2.in"), BytesIO(b"22"))
+    draft.delete(Path("1.in"))
+    draft.commit("edit cases")
+
+    changes = {change.path: change.type for change in master.diff("draft")}
+    assert changes == {"1.in": DiffType.removed, "2.in": DiffType.changed}
+
+    release = master.create_branch("release")
+    # staged on draft after its last commit, not synced
+    draft.upload(Path("3.in"), BytesIO(b"3"))
+    # the head of draft is resolved with the api client of release
+    draft_without_client = LakeFSStorage(
+        host_in_config="lakefs",
+        endpoint_url=f"{settings.lakefs_host}:{settings.lakefs_port}",
+        repo_name="config",
+        branch_name="draft",
+        username=settings.lakefs_username,
+        password=settings.lakefs_password,
+    )
+    release.sync_from(draft_without_client)
+    assert release.getinfo(Path("2.in")).size_bytes == 2
+    with pytest.raises(FileSystemError):
+        release.getinfo(Path("1.in"))
+    with pytest.raises(FileSystemError):
+        release.getinfo(Path("3.in"))
+    # release has staged changes now
+    with pytest.raises(FileSystemSyncError):
+        release.sync_from(draft)
+    draft.commit("add case")
+
+    draft.merge_into("master", "publish")
+    assert master.getinfo(Path("2.in")).size_bytes == 2
+    draft.delete_branch()
+    release.delete_branch()
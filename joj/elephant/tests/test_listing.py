@@ -0,0 +1,103 @@
+import os
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from joj.elephant.errors import FileSystemError
+from joj.elephant.listing import FileInfoBatch, diff_listings
+from joj.elephant.schemas import DiffType
+from joj.elephant.storage import LocalStorage, S3Storage
+
+
+def test_batch_round_trip() -> None:
+    batch = FileInfoBatch()
+    batch.append("1.in", size_bytes=3, mtime_ns=1_700_000_000_123_456_000)
+    batch.append("data", is_dir=True)
+    batch.append("data/2.in", size_bytes=0, checksum="abc")
+    assert batch.dirs == ["", "data"] and len(batch) == 3
+    assert list(batch.paths()) == ["1.in", "data", "data/2.in"]
+    entry = batch[0]
+    assert (entry.size_bytes, entry.checksum) == (3, None)
+    assert batch[1].is_dir and batch[1].size_bytes is None
+    assert batch[2].checksum == "abc"
+
+    file_infos = batch.to_file_infos()
+    assert file_infos[0].mtime is not None and file_infos[2].checksum == "abc"
+    assert list(FileInfoBatch.from_file_infos(file_infos)) == list(batch)
+
+
+def test_list_compact(tmp_path: Path) -> None:
+    for path in ("1.in", "data/a/2.in"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    storage = LocalStorage(str(tmp_path))
+    entries = {entry.path: entry for entry in storage.list_compact()}
+    assert set(entries) == {"1.in", "data", "data/a", "data/a/2.in"}
+    assert entries["data/a/2.in"].size_bytes == len("data/a/2.in")
+    mtime_ns = entries["1.in"].mtime_ns
+    assert mtime_ns is not None
+    # the backend reports a float epoch
+    assert abs(mtime_ns - os.stat(tmp_path / "1.in").st_mtime_ns) < 1000
+    assert [entry.path for entry in storage.list_compact(Path("data"))] == [
+        "a",
+        "a/2.in",
+    ]
+
+
+def test_diff_listings() -> None:
+    second = 1_000_000_000
+    source, dest = FileInfoBatch(), FileInfoBatch()
+    source.append("same", size_bytes=1, mtime_ns=10 * second + 5)
+    dest.append("same", size_bytes=1, mtime_ns=10 * second)
+    source.append("size", size_bytes=1, mtime_ns=10 * second)
+    dest.append("size", size_bytes=2, mtime_ns=10 * second)
+    source.append("mtime", size_bytes=1, mtime_ns=11 * second)
+    dest.append("mtime", size_bytes=1, mtime_ns=10 * second)
+    source.append("checksum", size_bytes=1, mtime_ns=11 * second, checksum="a")
+    dest.append("checksum", size_bytes=1, mtime_ns=10 * second, checksum="a")
+    source.append("new/1.in", size_bytes=1)
+    source.append("dir", is_dir=True)
+    dest.append("old/1.in", size_bytes=1)
+    # directories are matched by their interned paths, dest dirs are not files
+    source.append("data/1.in", size_bytes=1)
+    dest.append("data", is_dir=True)
+    dest.append("data/2.in", size_bytes=1)
+    dest.append("data/1.in", size_bytes=1)
+    source.append("data", size_bytes=1)
+    changes = {change.path: change.type for change in diff_listings(source, dest)}
+    assert changes == {
+        "size": DiffType.changed,
+        "mtime": DiffType.changed,
+        "new/1.in": DiffType.added,
+        "old/1.in": DiffType.removed,
+        "data/2.in": DiffType.removed,
+        "data": DiffType.added,
+    }
+
+
+def test_list_compact_s3(s3_storage: S3Storage) -> None:
+    s3_storage.upload(Path("data/1.in"), BytesIO(b"1 2\n"))
+    s3_storage.upload(Path("data/sub/2.in"), BytesIO(b"3"))
+    s3_storage.upload(Path("3.in"), BytesIO(b""))
+    heads = []
+    s3_storage.fs.client.meta.events.register(
+        "before-call.s3.HeadObject", lambda **kwargs: heads.append(kwargs)
+    )
+    batch = s3_storage.list_compact()
+    assert not heads
+    entries = {entry.path: entry for entry in batch}
+    assert {path for path, entry in entries.items() if entry.is_dir} == {
+        "data",
+        "data/sub",
+    }
+    entry = entries["data/1.in"]
+    assert entry.size_bytes == 4 and entry.mtime_ns
+    assert entry.checksum == s3_storage.getinfo(Path("data/1.in")).checksum
+    assert [entry.path for entry in s3_storage.list_compact(Path("data"))] == [
+        "1.in",
+        "sub",
+        "sub/2.in",
+    ]
+    with pytest.raises(FileSystemError):
+        s3_storage.list_compact(Path("missing"))
@@ -0,0 +1,83 @@
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import pytest
+
+from joj.elephant.errors import FileSystemError
+from joj.elephant.metrics import PrometheusHook, TracingHook, add_hook, remove_hook
+from joj.elephant.rclone import RClone
+from joj.elephant.storage import S3Storage, TempStorage
+
+
+@pytest.fixture
+def prometheus() -> Iterator[PrometheusHook]:
+    hook = PrometheusHook()
+    add_hook(hook)
+    yield hook
+    remove_hook(hook)
+
+
+@pytest.fixture
+def tracing() -> Iterator[TracingHook]:
+    hook = TracingHook()
+    add_hook(hook)
+    yield hook
+    remove_hook(hook)
+
+
+def test_prometheus(prometheus: PrometheusHook) -> None:
+    storage = TempStorage()
+    storage.upload(Path("1.in"), BytesIO(b"12345"))
+    storage.download(Path("1.in"), BytesIO())
+    with pytest.raises(FileSystemError):
+        storage.getinfo(Path("2.in"))
+    text = prometheus.render()
+    assert (
+        'elephant_operation_duration_seconds_count{backend="TempStorage",operation="upload"} 1'
+        in text
+    )
+    # upload calls getinfo once more
+    assert (
+        'elephant_operation_duration_seconds_count{backend="TempStorage",operation="getinfo"} 2'
+        in text
+    )
+    assert (
+        'elephant_operation_bytes_total{backend="TempStorage",operation="upload"} 5'
+        in text
+    )
+    assert (
+        'elephant_operation_bytes_total{backend="TempStorage",operation="download"} 5'
+        in text
+    )
+    assert (
+        'elephant_operation_errors_total{backend="TempStorage",operation="getinfo",'
+        'error="FileSystemError"} 1' in text
+    )
+
+
+def test_tracing(tracing: TracingHook) -> None:
+    TempStorage().upload(Path("1.in"), BytesIO(b"1"))
+    RClone("").run_cmd("version", ["--no-such-flag"])
+    getinfo, upload, rclone = tracing.spans
+    assert upload.name == "TempStorage.upload" and upload.parent_id is None
+    assert getinfo.parent_id == upload.span_id
+    assert getinfo.trace_id == upload.trace_id
+    assert rclone.name == "rclone.version"
+    assert rclone.attributes["exit_code"] != "0"
+    assert rclone.attributes["error"].startswith("exit_")
+
+
+@pytest.mark.parametrize("metadata", [None, {"lang": "c"}])
+def test_s3_upload_instrumented_once(
+    s3_storage: S3Storage,
+    prometheus: PrometheusHook,
+    tracing: TracingHook,
+    metadata: Optional[Dict[str, str]],
+) -> None:
+    s3_storage.upload(Path("1.in"), BytesIO(b"12345"), metadata=metadata)
+    assert [span.name for span in tracing.spans].count("S3Storage.upload") == 1
+    assert (
+        'elephant_operation_bytes_total{backend="S3Storage",operation="upload"} 5'
+        in prometheus.render()
+    )
@@ -0,0 +1,94 @@
+import gc
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pytest
+
+from joj.elephant import s3
+from joj.elephant.rate_control import AdaptiveConcurrencyController, is_throttled
+from joj.elephant.storage import S3Storage
+
+
+def test_additive_increase_multiplicative_decrease() -> None:
+    controller = AdaptiveConcurrencyController(initial_limit=4, max_limit=5)
+    for _ in range(4):
+        controller.acquire()
+        controller.release(0.01)
+    assert controller.limit == 4
+    for _ in range(40):
+        controller.acquire()
+        controller.release(0.01)
+    assert controller.limit == 5
+
+    controller.acquire()
+    controller.release(0.01, throttled=True)
+    assert controller.limit == 2
+    # a second throttled response of the same round trip is not counted again
+    controller.acquire()
+    controller.release(10.0, throttled=True)
+    assert controller.stats == (2, 0, 46, 2, 0)
+
+
+def test_latency_threshold() -> None:
+    controller = AdaptiveConcurrencyController(
+        initial_limit=8, min_limit=4, latency_threshold=0.5
+    )
+    controller.acquire()
+    controller.release(1.0)
+    assert controller.limit == 4
+    assert controller.stats.slow == 1
+
+
+@pytest.mark.parametrize(
+    "response_dict,parsed_response,expected",
+    [
+        ({"status_code": 503}, None, True),
+        ({"status_code": 200}, {"Error": {"Code": "SlowDown"}}, True),
+        ({"status_code": 404}, {"Error": {"Code": "NoSuchKey"}}, False),
+        (None, None, False),
+    ],
+)
+def test_is_throttled(
+    response_dict: Optional[Dict[str, Any]],
+    parsed_response: Optional[Dict[str, Any]],
+    expected: bool,
+) -> None:
+    assert is_throttled(response_dict, parsed_response) is expected
+
+
+def test_s3_storage_requests_are_controlled(s3_storage: S3Storage) -> None:
+    controller = s3_storage.rate_controller
+    assert controller is not None
+    requests = controller.stats.requests
+    s3_storage.upload(Path("1.in"), BytesIO(b"1 2\n"))
+    assert s3_storage.read_range(Path("1.in"), 0) == b"1 2\n"
+    stats = controller.stats
+    assert stats.requests > requests
+    assert stats.in_flight == 0
+
+
+def test_s3fs_pools_clients_only() -> None:
+    def create() -> s3.RateControlledS3FS:
+        return s3.RateControlledS3FS(
+            "test",
+            aws_access_key_id="pooled",
+            aws_secret_access_key="secret",
+            endpoint_url="http://127.0.0.1:9",
+            region="us-east-1",
+        )
+
+    def share() -> None:
+        first, second = create(), create()
+        assert first.client is second.client
+        resources = [first.s3]
+        thread = threading.Thread(target=lambda: resources.append(first.s3))
+        thread.start()
+        thread.join()
+        assert resources[0] is not resources[1]
+
+    share()
+    # the pool does not keep a client (and its credentials) alive
+    gc.collect()
+    assert all(key[1] != "pooled" for key in s3._clients.keys())
@@ -0,0 +1,91 @@
+import os
+from io import BytesIO
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from joj.elephant.benchmarks.fake_rclone import install_fake_rclone
+from joj.elephant.errors import FileSystemSyncError
+from joj.elephant.manager import Manager
+from joj.elephant.rclone import RClone
+from joj.elephant.shard import ShardStrategy, list_files, partition
+from joj.elephant.storage import LocalStorage, S3Storage
+
+FILES = ["1.in", "data/a/1.in", "data/a/2.in", "data/b/1.in", "extra/1.in"]
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    root = tmp_path / "source"
+    for path in FILES:
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text(path)
+    return root
+
+
+def test_list_files(source: Path) -> None:
+    assert list_files(LocalStorage(str(source)), jobs=2) == set(FILES)
+
+
+def test_list_files_s3(s3_storage: S3Storage) -> None:
+    for path in FILES:
+        s3_storage.upload(Path(path), BytesIO(path.encode()))
+    operations: List[str] = []
+
+    def record(model: Any, **kwargs: Any) -> None:
+        operations.append(model.name)
+
+    s3_storage.fs.client.meta.events.register("before-call.s3", record)
+    assert list_files(s3_storage, jobs=2) == set(FILES)
+    # the root, then one paged listing per top-level directory (not per directory)
+    assert operations.count("ListObjectsV2") + operations.count("ListObjects") == 3
+
+
+@pytest.mark.parametrize("strategy", list(ShardStrategy))
+def test_partition(strategy: ShardStrategy) -> None:
+    files = [f"{d}/{i}.in" for d in "abcd" for i in range(10)]
+    shards = partition(files, 3, strategy)
+    assert len(shards) <= 3
+    assert sorted(path for shard in shards for path in shard) == sorted(files)
+    if strategy == ShardStrategy.prefix:
+        prefixes = [{path[0] for path in shard} for shard in shards]
+        assert sum(len(p) for p in prefixes) == 4
+
+
+@pytest.mark.parametrize("strategy", ["hash", "prefix"])
+def test_sync_sharded(source: Path, tmp_path: Path, strategy: str) -> None:
+    dest = tmp_path / "dest"
+    (dest / "stale").mkdir(parents=True)
+    (dest / "stale" / "1.in").write_text("stale")
+    (dest / "1.in").write_text("old")
+    manager = Manager(
+        RClone(""), LocalStorage(str(source)), LocalStorage(str(dest)), verify_sync=True
+    )
+    with install_fake_rclone(str(tmp_path / "bin")):
+        report = manager.sync_sharded(shards=3, strategy=strategy, jobs=2)
+    assert report.files == len(FILES) and report.deleted == 1
+    assert sum(shard.files for shard in report.shards) == len(FILES)
+    for path in FILES:
+        assert (dest / path).read_text() == path
+    assert not (dest / "stale" / "1.in").exists()
+
+
+def test_sync_sharded_failure(source: Path, tmp_path: Path) -> None:
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (dest / "stale.in").write_text("stale")
+    manager = Manager(RClone(""), LocalStorage(str(source)), LocalStorage(str(dest)))
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "rclone").write_text("#!/bin/sh\nexit 1\n")
+    os.chmod(bin_dir / "rclone", 0o755)
+    old_path = os.environ["PATH"]
+    os.environ["PATH"] = os.pathsep.join([str(bin_dir), old_path])
+    try:
+        with pytest.raises(FileSystemSyncError):
+            manager.sync_sharded(shards=2)
+    finally:
+        os.environ["PATH"] = old_path
+    # nothing is deleted when a shard failed
+    assert (dest / "stale.in").exists()
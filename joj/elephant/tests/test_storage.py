@@ -0,0 +1,224 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any
+
+import pytest
+from botocore.exceptions import ClientError
+
+from joj.elephant.checkpoint import CheckpointStore
+from joj.elephant.errors import FileSystemError, FileSystemSyncError
+from joj.elephant.manager import Manager
+from joj.elephant.rclone import RClone
+from joj.elephant.schemas import TransferCheckpoint
+from joj.elephant.storage import (
+    CodeTextStorage,
+    LocalStorage,
+    MemoryStorage,
+    MultipleFilesStorage,
+    S3Storage,
+    TempStorage,
+)
+
+
+@pytest.fixture
+def storage() -> TempStorage:
+    storage = TempStorage()
+    storage.fs.writebytes("case.out", b"0123456789")
+    storage.fs.writebytes("empty.out", b"")
+    return storage
+
+
+@pytest.mark.parametrize(
+    "offset,length,expected",
+    [(0, 4, b"0123"), (6, None, b"6789"), (8, 100, b"89"), (20, 5, b""), (3, 0, b"")],
+)
+def test_read_range(
+    storage: TempStorage, offset: int, length: int, expected: bytes
+) -> None:
+    assert storage.read_range(Path("case.out"), offset, length) == expected
+
+
+def test_read_range_missing(storage: TempStorage) -> None:
+    with pytest.raises(FileSystemError):
+        storage.read_range(Path("missing.out"), 0, 1)
+
+
+def test_open_mmap(storage: TempStorage) -> None:
+    with storage.open_mmap(Path("case.out")) as view:
+        assert view.readonly
+        assert bytes(view[2:5]) == b"234"
+    with storage.open_mmap(Path("empty.out")) as view:
+        assert len(view) == 0
+
+
+def test_copy_to(storage: TempStorage, tmp_path: Path) -> None:
+    dest = LocalStorage(str(tmp_path))
+    file_info = storage.copy_to(Path("case.out"), dest, Path("data/1.out"))
+    assert file_info.size_bytes == 10
+    assert (tmp_path / "data" / "1.out").read_bytes() == b"0123456789"
+
+
+def test_code_text_storage() -> None:
+    storages = CodeTextStorage.create_many(
+        [("a.cpp", "int main() {}"), ("b.py", "print(1)")]
+    )
+    assert all(storage.in_memory and storage.path == "" for storage in storages)
+    assert all(isinstance(storage, TempStorage) for storage in storages)
+    assert storages[0].read_range(Path("a.cpp"), 0) == b"int main() {}"
+
+
+def test_memory_storage_overwrite() -> None:
+    storage = MemoryStorage(spill_threshold=100)
+    for _ in range(5):
+        storage.write_bytes(Path("a.cpp"), b"x" * 30)
+    storage.upload(Path("b.cpp"), BytesIO(b"y" * 30))
+    storage.upload(Path("b.cpp"), BytesIO(b"y" * 30))
+    assert storage.in_memory and storage.size_bytes == 60
+    storage.delete(Path("a.cpp"))
+    assert storage.size_bytes == 30
+
+
+def test_sync_in_memory(tmp_path: Path) -> None:
+    (tmp_path / "stale.cpp").write_text("stale")
+    storage = CodeTextStorage("a.cpp", "int main() {}")
+    Manager(RClone(""), storage, LocalStorage(str(tmp_path))).sync_without_validation()
+    assert (tmp_path / "a.cpp").read_text() == "int main() {}"
+    assert not (tmp_path / "stale.cpp").exists()
+
+
+def test_multiple_files_storage_spill(tmp_path: Path) -> None:
+    storage = MultipleFilesStorage(
+        ["main.c", "lib/util.h"],
+        [BytesIO(b"x" * 64), BytesIO(b"y" * 64)],
+        spill_threshold=100,
+    )
+    assert not storage.in_memory
+    assert (Path(storage.path) / "lib" / "util.h").read_bytes() == b"y" * 64
+
+    dest = LocalStorage(str(tmp_path))
+    file_infos = storage.copy_all_to(dest, Path("submission"))
+    assert sorted(file_info.path for file_info in file_infos) == [
+        "submission/lib/util.h",
+        "submission/main.c",
+    ]
+
+
+def test_upload_resumable(
+    storage: TempStorage, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    source = tmp_path / "big.in"
+    source.write_bytes(b"0123456789")
+    checkpoints = CheckpointStore(str(tmp_path / "checkpoints"))
+    saved_offsets = []
+    save = checkpoints.save
+
+    def interrupted_save(key: str, checkpoint: TransferCheckpoint) -> None:
+        save(key, checkpoint)
+        saved_offsets.append(checkpoint.offset)
+        if len(saved_offsets) == 2:
+            raise OSError("connection reset")
+
+    monkeypatch.setattr(checkpoints, "save", interrupted_save)
+    with pytest.raises(FileSystemError):
+        storage.upload_resumable(Path("big.in"), str(source), checkpoints, 4)
+    monkeypatch.undo()
+    assert saved_offsets == [4, 8]
+    checkpoint = checkpoints.load(f"{storage.path}|big.in", str(source))
+    assert checkpoint is not None and checkpoint.offset == 8
+
+    file_info = storage.upload_resumable(Path("big.in"), str(source), checkpoints, 4)
+    assert file_info.size_bytes == 10
+    assert storage.fs.readbytes("big.in") == b"0123456789"
+    assert not storage.fs.exists("big.in.partial")
+    assert checkpoints.load(f"{storage.path}|big.in", str(source)) is None
+
+
+def test_upload_resumable_s3_chunk_size_changed(
+    s3_storage: S3Storage, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    mib = 1024 * 1024
+    data = bytes(range(256)) * (12 * mib // 256)
+    source = tmp_path / "big.in"
+    source.write_bytes(data)
+    checkpoints = CheckpointStore(str(tmp_path / "checkpoints"))
+    save = checkpoints.save
+
+    def interrupted_save(key: str, checkpoint: TransferCheckpoint) -> None:
+        save(key, checkpoint)
+        if checkpoint.parts:
+            raise OSError("connection reset")
+
+    monkeypatch.setattr(checkpoints, "save", interrupted_save)
+    with pytest.raises(FileSystemError):
+        s3_storage.upload_resumable(Path("big.in"), str(source), checkpoints, 5 * mib)
+    monkeypatch.undo()
+    file_info = s3_storage.upload_resumable(
+        Path("big.in"), str(source), checkpoints, 6 * mib
+    )
+    assert file_info.size_bytes == len(data)
+    assert s3_storage.fs.readbytes("big.in") == data
+
+    # a checkpoint whose parts do not cover the file is never completed
+    monkeypatch.setattr(checkpoints, "save", interrupted_save)
+    with pytest.raises(FileSystemError):
+        s3_storage.upload_resumable(Path("big.in"), str(source), checkpoints, 5 * mib)
+    monkeypatch.undo()
+    key = f"{s3_storage.path}|big.in"
+    checkpoint = checkpoints.load(key, str(source))
+    assert checkpoint is not None
+    checkpoint.parts[0].size_bytes = 6 * mib
+    checkpoint.parts.extend(
+        part.copy(update={"part_number": 2}) for part in list(checkpoint.parts)
+    )
+    checkpoints.save(key, checkpoint)
+    monkeypatch.setattr(
+        s3_storage,
+        "_list_uploaded_parts",
+        lambda *args: {part.part_number: part.etag for part in checkpoint.parts},
+    )
+    with pytest.raises(FileSystemSyncError):
+        s3_storage.upload_resumable(Path("big.in"), str(source), checkpoints, 5 * mib)
+    assert s3_storage.fs.readbytes("big.in") == data
+
+
+def test_upload_resumable_s3_small_chunks(
+    s3_storage: S3Storage, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    mib = 1024 * 1024
+    data = os.urandom(3 * mib)
+    source = tmp_path / "small.in"
+    source.write_bytes(data)
+    checkpoints = CheckpointStore(str(tmp_path / "checkpoints"))
+    # raised to the minimum part size of S3
+    file_info = s3_storage.upload_resumable(
+        Path("small.in"), str(source), checkpoints, mib
+    )
+    assert file_info.size_bytes == len(data)
+    assert s3_storage.fs.readbytes("small.in") == data
+
+    def entity_too_small(**kwargs: Any) -> None:
+        raise ClientError(
+            {"Error": {"Code": "EntityTooSmall"}}, "CompleteMultipartUpload"
+        )
+
+    client = s3_storage.fs.client
+    monkeypatch.setattr(client, "complete_multipart_upload", entity_too_small)
+    with pytest.raises(FileSystemError):
+        s3_storage.upload_resumable(Path("small.in"), str(source), checkpoints)
+    assert checkpoints.load(f"{s3_storage.path}|small.in", str(source)) is None
+    uploads = client.list_multipart_uploads(Bucket=s3_storage.fs._bucket_name)
+    assert not uploads.get("Uploads")
+
+
+def test_memory_storage_concurrent_spill() -> None:
+    storage = MemoryStorage(spill_threshold=64 * 1024)
+    paths = [Path(f"data/{i}.in") for i in range(200)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            executor.map(lambda path: storage.upload(path, BytesIO(b"0" * 1024)), paths)
+        )
+    assert not storage.in_memory
+    assert storage.size_bytes == 200 * 1024
+    assert all(storage.fs.getsize(str(path)) == 1024 for path in paths)
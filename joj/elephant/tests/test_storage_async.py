@@ -0,0 +1,115 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional
+
+import pytest
+
+from joj.elephant.errors import FileSystemError
+from joj.elephant.schemas import FileInfo
+from joj.elephant.storage import TempStorage
+from joj.elephant.storage_async import AsyncStorage
+
+
+@pytest.mark.asyncio
+async def test_batch_operations() -> None:
+    storage = AsyncStorage(TempStorage(), max_concurrency=4)
+    paths = [Path(f"data/{i}.in") for i in range(20)]
+
+    uploaded = [
+        result
+        async for result in storage.upload_many(
+            (path, BytesIO(str(path).encode())) for path in paths
+        )
+    ]
+    assert sorted(result.path for result in uploaded) == sorted(paths)
+    assert all(result.error is None for result in uploaded)
+
+    files = {path: BytesIO() for path in paths}
+    async for result in storage.download_many(files.items()):
+        assert result.error is None
+    assert all(file.getvalue() == str(path).encode() for path, file in files.items())
+
+    results = [result async for result in storage.delete_many(paths + [Path("x")])]
+    errors = [result for result in results if result.error is not None]
+    assert [result.path for result in errors] == [Path("x")]
+    assert isinstance(errors[0].error, FileSystemError)
+
+    async for result in storage.getinfo_many(paths):
+        assert isinstance(result.error, FileSystemError)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_batch_executor_hops(monkeypatch: pytest.MonkeyPatch) -> None:
+    storage = AsyncStorage(TempStorage(), max_concurrency=4)
+    submitted = []
+    submit = ThreadPoolExecutor.submit
+
+    def counting_submit(self: ThreadPoolExecutor, *args: Any, **kwargs: Any) -> Any:
+        submitted.append(args)
+        return submit(self, *args, **kwargs)
+
+    monkeypatch.setattr(ThreadPoolExecutor, "submit", counting_submit)
+    paths = [Path(f"{i}.in") for i in range(50)]
+    results = [
+        result
+        async for result in storage.upload_many((path, BytesIO(b"1")) for path in paths)
+    ]
+    assert len(results) == 50 and len(submitted) == 4
+
+    def broken(path: Path) -> None:
+        raise RuntimeError("broken")
+
+    with pytest.raises(RuntimeError):
+        async for _ in storage._run_many(broken, [(path,) for path in paths]):
+            pass
+    await storage.close()
+
+
+class SlowStorage(TempStorage):
+    """Uploads take 10ms, counting the uploads running at the same time."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def upload(
+        self,
+        path: Path,
+        file: BinaryIO,
+        chunk_size: Optional[int] = None,
+        metadata: Optional[Dict[str, str]] = None,
+    ) -> FileInfo:
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.01)
+        try:
+            return super().upload(path, file, chunk_size, metadata)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_batch_shares_slots() -> None:
+    slow = SlowStorage()
+    storage = AsyncStorage(slow, max_concurrency=2)
+    files = [(Path(f"a/{i}.in"), BytesIO(b"1")) for i in range(200)]
+    other = [(Path(f"b/{i}.in"), BytesIO(b"2")) for i in range(4)]
+    results = storage.upload_many(files)
+    first = await results.__anext__()
+    # a single call and a second batch wait for a slot, not for the batch
+    start = time.perf_counter()
+    await storage.getinfo(first.path)
+    other_results = [result async for result in storage.upload_many(other)]
+    assert time.perf_counter() - start < 0.5
+    assert all(result.error is None for result in other_results)
+    remaining = [result async for result in results]
+    assert len(remaining) == 199 and slow.max_running == 2
+    await storage.close()
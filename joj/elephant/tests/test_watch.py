@@ -0,0 +1,118 @@
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Iterator, Tuple
+
+import orjson
+import pytest
+
+from joj.elephant.benchmarks.fake_rclone import install_fake_rclone
+from joj.elephant.errors import FileSystemError, FileSystemSyncError
+from joj.elephant.manager import Manager
+from joj.elephant.rclone import RClone
+from joj.elephant.schemas import Config
+from joj.elephant.storage import LocalStorage
+from joj.elephant.watch import WatchBatch, Watcher
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is linux only"
+)
+
+
+@pytest.fixture
+def watching(tmp_path: Path) -> Iterator[Tuple[Path, Path, "queue.Queue[WatchBatch]"]]:
+    source = tmp_path / "source"
+    dest = tmp_path / "dest"
+    source.mkdir()
+    (source / "config.json").write_bytes(
+        orjson.dumps(Config.generate_default_value().dict())
+    )
+    (source / ".gitignore").write_text("*.o\n")
+    (source / "1.in").write_text("1 2\n")
+    manager = Manager(
+        RClone(""), LocalStorage(str(source)), LocalStorage(str(dest), create=True)
+    )
+    batches: "queue.Queue[WatchBatch]" = queue.Queue()
+    stop = threading.Event()
+    with install_fake_rclone(str(tmp_path / "bin")):
+        thread = threading.Thread(
+            target=manager.watch,
+            kwargs={"stop": stop, "debounce": 0.05, "on_batch": batches.put},
+        )
+        thread.start()
+        try:
+            assert batches.get(timeout=5).full_sync
+            yield source, dest, batches
+        finally:
+            stop.set()
+            thread.join()
+
+
+def test_watch(watching: Tuple[Path, Path, "queue.Queue[WatchBatch]"]) -> None:
+    source, dest, batches = watching
+    assert (dest / "1.in").read_text() == "1 2\n"
+    (source / "2.in").write_text("3 4\n")
+    batch = batches.get(timeout=5)
+    assert batch.uploaded == ["2.in"] and not batch.validated
+
+    (source / "data").mkdir()
+    (source / "data" / "3.in").write_text("5 6\n")
+    (source / "a.o").write_bytes(b"\0")
+    (source / "1.in").unlink()
+    uploaded, deleted = set(), set()
+    while "data/3.in" not in uploaded or "1.in" not in deleted:
+        batch = batches.get(timeout=5)
+        uploaded.update(batch.uploaded)
+        deleted.update(batch.deleted)
+    assert (dest / "data" / "3.in").read_text() == "5 6\n"
+    assert not (dest / "1.in").exists() and not (dest / "a.o").exists()
+
+
+def test_watch_invalid_config(
+    watching: Tuple[Path, Path, "queue.Queue[WatchBatch]"]
+) -> None:
+    source, dest, batches = watching
+    (source / "config.json").write_text("{")
+    (source / "2.in").write_text("3 4\n")
+    batch = batches.get(timeout=5)
+    assert batch.error is not None and not batch.uploaded
+    assert not (dest / "2.in").exists()
+
+    (source / "config.json").write_bytes(
+        orjson.dumps(Config.generate_default_value().dict())
+    )
+    batch = batches.get(timeout=5)
+    assert batch.validated and batch.error is None
+    assert set(batch.uploaded) == {"2.in", "config.json"}
+
+
+def test_watch_failed_push(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    source = tmp_path / "source"
+    source.mkdir()
+    (source / "1.in").write_text("1 2\n")
+    dest = LocalStorage(str(tmp_path / "dest"), create=True)
+    manager = Manager(RClone(""), LocalStorage(str(source)), dest)
+    watcher = Watcher(manager, max_delay=0)
+    watcher.changes = {"1.in": True, "gone.in": True, "never-pushed.o": False}
+
+    def broken_copy_to(*args: Any, **kwargs: Any) -> None:
+        raise FileSystemError("connection reset")
+
+    monkeypatch.setattr(manager.source, "copy_to", broken_copy_to)
+    batch = watcher.flush()
+    assert batch.failed == ["1.in"] and not batch.uploaded
+    assert watcher.changes == {"1.in": True} and watcher.pending
+    monkeypatch.undo()
+    batch = watcher.flush()
+    assert batch.uploaded == ["1.in"] and not batch.failed and not watcher.pending
+
+    def broken_sync() -> None:
+        raise FileSystemSyncError("sync failed")
+
+    watcher.full_sync = True
+    monkeypatch.setattr(manager, "validate_source", lambda: None)
+    monkeypatch.setattr(manager, "sync_without_validation", broken_sync)
+    batch = watcher.flush()
+    assert batch.full_sync and isinstance(batch.error, FileSystemSyncError)
+    assert watcher.full_sync and watcher.pending
@@ -0,0 +1,370 @@
+"""
+Incremental sync of a local problem directory driven by Linux inotify.
+
+Events are collected until the tree has been quiet for debounce seconds, then
+only the changed files are pushed to the destination. The config is validated
+again only when config.json or .gitignore changed; while it is invalid the
+changes are kept and pushed after the next successful validation. Paths that
+failed to push (and a failed full sync) are kept too and retried after
+max_delay seconds.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from threading import Event
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from fs.errors import FSError
+from loguru import logger
+
+from joj.elephant.errors import (
+    ConfigError,
+    ElephantError,
+    FileSystemError,
+    FileSystemUndefinedError,
+)
+from joj.elephant.storage import Storage
+
+if TYPE_CHECKING:
+    from joj.elephant.manager import Manager
+
+DEFAULT_DEBOUNCE = 0.1
+DEFAULT_MAX_DELAY = 1.0
+STOP_POLL_INTERVAL = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+# files whose change requires validating the config again
+CONFIG_FILES = {"config.json", ".gitignore"}
+
+
+class InotifyEvent(NamedTuple):
+    path: str
+    mask: int
+
+
+class Inotify:
+    """A minimal recursive inotify watch over ctypes."""
+
+    def __init__(self, root: str) -> None:
+        if not sys.platform.startswith("linux"):
+            raise FileSystemError("watch mode requires linux inotify!")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.root = os.path.abspath(root)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise FileSystemError(os.strerror(ctypes.get_errno()))
+        self._paths: Dict[int, str] = {}
+
+    def add_tree(self, path: str) -> List[str]:
+        """Watch path and its sub-directories, return the files found."""
+        files = []
+        for dir_path, dir_names, file_names in os.walk(path):
+            wd = self._libc.inotify_add_watch(
+                self.fd, os.fsencode(dir_path), WATCH_MASK
+            )
+            if wd < 0:
+                # removed in the meantime, its events will follow
+                logger.debug("failed to watch {}", dir_path)
+                continue
+            self._paths[wd] = os.path.relpath(dir_path, self.root)
+            files += [os.path.join(dir_path, name) for name in file_names]
+        return files
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return bool(readable)
+
+    def read(self) -> Iterator[InotifyEvent]:
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            dir_path = self._paths.get(wd)
+            if dir_path is None and not mask & IN_Q_OVERFLOW:
+                continue
+            path = os.path.normpath(os.path.join(dir_path or "", os.fsdecode(name)))
+            yield InotifyEvent(path=path, mask=mask)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class WatchBatch(NamedTuple):
+    uploaded: List[str]
+    deleted: List[str]
+    # kept pending, pushed again with the next batch
+    failed: List[str] = []
+    validated: bool = False
+    full_sync: bool = False
+    error: Optional[ElephantError] = None
+    seconds: float = 0.0
+
+
+class Watcher:
+    """
+    Push the changes of a local source to the destination of manager as they
+    happen. Files ignored by .gitignore are not pushed.
+    """
+
+    def __init__(
+        self,
+        manager: "Manager",
+        debounce: float = DEFAULT_DEBOUNCE,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        delta: bool = False,
+        on_batch: Optional[Callable[[WatchBatch], None]] = None,
+    ) -> None:
+        root = manager.source.getsyspath(Path("/"))
+        if root is None:
+            raise FileSystemError("watch mode requires a local source!")
+        if manager.dest is None:
+            raise FileSystemUndefinedError("destination not defined!")
+        self.manager = manager
+        self.dest: Storage = manager.dest
+        self.root = root
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.delta = delta
+        self.on_batch = on_batch
+        self.inotify: Optional[Inotify] = None
+        # path relative to root -> whether it still exists
+        self.changes: Dict[str, bool] = {}
+        self.removed_dirs: Set[str] = set()
+        self.full_sync = False
+        self.needs_validation = False
+        # validation failed, wait for the next event before retrying
+        self.invalid = False
+        self._first_change: Optional[float] = None
+        # pushing failed, wait until then before retrying
+        self._retry_at = 0.0
+
+    @property
+    def pending(self) -> bool:
+        return (
+            not self.invalid
+            and time.monotonic() >= self._retry_at
+            and bool(self.changes or self.removed_dirs or self.full_sync)
+        )
+
+    def handle(self, event: InotifyEvent) -> None:
+        self.invalid = False
+        if self._first_change is None:
+            self._first_change = time.monotonic()
+        if event.mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflow, sync the whole tree")
+            self.full_sync = True
+            return
+        path = event.path
+        if event.mask & IN_ISDIR:
+            if event.mask & (IN_CREATE | IN_MOVED_TO) and self.inotify is not None:
+                # files written before the watch was added have no events
+                self.removed_dirs.discard(path)
+                for file_path in self.inotify.add_tree(os.path.join(self.root, path)):
+                    self.changes[os.path.relpath(file_path, self.root)] = True
+            elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+                self.removed_dirs.add(path)
+                prefix = path + os.sep
+                for changed in [p for p in self.changes if p.startswith(prefix)]:
+                    del self.changes[changed]
+            return
+        if event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self.changes[path] = True
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+            self.changes[path] = False
+        if path in CONFIG_FILES:
+            self.needs_validation = True
+
+    def validate(self) -> None:
+        """Validate the config and reload the ignore rules."""
+        self.manager.validate_source()
+        if self.manager.source.fs.exists(".gitignore"):
+            self.manager._init_ignore()
+        else:
+            self.manager.ignore = None
+
+    def flush(self) -> WatchBatch:
+        start = time.perf_counter()
+        validated = self.needs_validation or self.full_sync
+        if validated:
+            try:
+                self.validate()
+            except (ElephantError, FSError, ValueError) as e:
+                # keep the changes until the config is fixed
+                logger.error("validation failed: {}", e)
+                self.invalid = True
+                self._first_change = None
+                error = e if isinstance(e, ElephantError) else ConfigError(str(e))
+                return WatchBatch(
+                    uploaded=[],
+                    deleted=[],
+                    validated=False,
+                    error=error,
+                    seconds=time.perf_counter() - start,
+                )
+            self.needs_validation = False
+        self._first_change = None
+        if self.full_sync:
+            try:
+                self.manager.sync_without_validation()
+            except ElephantError as e:
+                # keep full_sync and the changes, the next sync covers them
+                logger.error("sync failed: {}", e)
+                self._retry_at = time.monotonic() + self.max_delay
+                return WatchBatch(
+                    uploaded=[],
+                    deleted=[],
+                    validated=validated,
+                    full_sync=True,
+                    error=e,
+                    seconds=time.perf_counter() - start,
+                )
+            self.changes.clear()
+            self.removed_dirs.clear()
+            self.full_sync = False
+            batch = WatchBatch(
+                uploaded=[], deleted=[], validated=validated, full_sync=True
+            )
+        else:
+            uploaded, deleted, failed = self._push()
+            batch = WatchBatch(
+                uploaded=uploaded, deleted=deleted, failed=failed, validated=validated
+            )
+            if failed:
+                self._retry_at = time.monotonic() + self.max_delay
+        return batch._replace(seconds=time.perf_counter() - start)
+
+    def _is_gone(self, path: str) -> bool:
+        """Whether path is missing at the destination (False if unknown)."""
+        try:
+            return not self.dest.fs.exists(path)
+        except FSError:
+            return False
+
+    def _push(self) -> Tuple[List[str], List[str], List[str]]:
+        """
+        Push the changes, the paths that failed stay in self.changes (or in
+        self.removed_dirs) and are returned as failed.
+        """
+        ignore = self.manager.ignore
+        uploaded = []
+        deleted = []
+        failed = []
+        for path in sorted(self.removed_dirs):
+            try:
+                self.dest.delete_tree(Path(path))
+                deleted.append(path)
+            except FileSystemError as e:
+                if not self._is_gone(path):
+                    logger.warning("failed to delete {}: {}", path, e)
+                    failed.append(path)
+        self.removed_dirs.intersection_update(failed)
+        changes, self.changes = self.changes, {}
+        for path, exists in sorted(changes.items()):
+            if ignore is not None and path not in CONFIG_FILES and ignore(f"/{path}"):
+                continue
+            try:
+                if exists:
+                    if not os.path.isfile(os.path.join(self.root, path)):
+                        # e.g. replaced by a directory, its files follow
+                        continue
+                    self.manager.source.copy_to(Path(path), self.dest, delta=self.delta)
+                    uploaded.append(path)
+                else:
+                    self.dest.delete(Path(path))
+                    deleted.append(path)
+            except FileSystemError as e:
+                if exists and not os.path.isfile(os.path.join(self.root, path)):
+                    # removed meanwhile, its delete event follows
+                    logger.debug("skip {}: {}", path, e)
+                elif not exists and self._is_gone(path):
+                    # e.g. a temporary file never pushed
+                    logger.debug("skip {}: {}", path, e)
+                else:
+                    logger.warning("failed to push {}: {}", path, e)
+                    self.changes.setdefault(path, exists)
+                    failed.append(path)
+        return uploaded, deleted, failed
+
+    def _is_due(self) -> bool:
+        return (
+            self._first_change is not None
+            and time.monotonic() - self._first_change >= self.max_delay
+        )
+
+    def _report(self, batch: WatchBatch) -> None:
+        logger.info(
+            "pushed {} and deleted {} files in {:.3f}s, {} failed",
+            len(batch.uploaded),
+            len(batch.deleted),
+            batch.seconds,
+            len(batch.failed),
+        )
+        if self.on_batch is not None:
+            self.on_batch(batch)
+
+    def run(self, stop: Optional[Event] = None, initial_sync: bool = True) -> None:
+        """
+        Watch until stop is set. The initial full sync (if any) is reported
+        as the first batch, edits after it are never missed.
+        """
+        self.inotify = Inotify(self.root)
+        try:
+            self.inotify.add_tree(self.root)
+            if initial_sync:
+                self.full_sync = True
+                self._report(self.flush())
+            elif self.manager.source.fs.exists(".gitignore"):
+                self.manager._init_ignore()
+            while stop is None or not stop.is_set():
+                timeout = self.debounce if self.pending else STOP_POLL_INTERVAL
+                if self.inotify.wait(timeout):
+                    for event in self.inotify.read():
+                        self.handle(event)
+                    if not self._is_due():
+                        continue
+                if self.pending:
+                    self._report(self.flush())
+        finally:
+            self.inotify.close()
+            self.inotify = None